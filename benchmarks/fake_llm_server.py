@@ -0,0 +1,256 @@
+import argparse
+import collections
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Ollama and Groq APIs used by the evaluation pipeline,
+# answering with random (but schema valid) evaluations so throughput can be
+# measured without spending tokens or GPU time. It serves:
+# - POST /api/generate: Ollama's streaming endpoint (one token per event,
+#   with a <think> block for reasoning models unless the request is raw)
+# - POST /openai/v1/chat/completions: Groq's OpenAI compatible endpoint
+#
+# Usage:
+#
+#   python -m benchmarks.fake_llm_server --port 11500 --latency 0.2 --rate-limit 30
+#
+# then point Ollama clients at http://localhost:11500 and Groq chains at it
+# through the GROQ_API_BASE environment variable.
+
+CRITERIA = ["coverage", "clarity", "edge_and_negative_cases_score", "non_functional_coverage"]
+
+
+# Configuration of the fake server
+class FakeServerConfig:
+    def __init__(
+        self,
+        latency=0.05,
+        token_latency=0.0,
+        rate_limit=None,
+        rate_window=60.0,
+        malformed_rate=0.0,
+        think_tokens=0,
+        seed=0,
+    ):
+        # Seconds before the first token, and between streamed tokens
+        self.latency = latency
+        self.token_latency = token_latency
+        # Requests accepted per `rate_window` seconds before answering 429
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        # Share of responses whose JSON is truncated
+        self.malformed_rate = malformed_rate
+        # Tokens of reasoning emitted in a <think> block by reasoning models
+        self.think_tokens = think_tokens
+        self.seed = seed
+
+
+# Function to build a random evaluation in the format the parser expects
+def make_evaluation(rng):
+    evaluation = {
+        criterion: {"score": rng.randint(1, 5), "reason": f"Synthetic reason for {criterion}."}
+        for criterion in CRITERIA
+    }
+    evaluation["justification"] = "Synthetic evaluation produced by the fake LLM server."
+    return json.dumps({"test_case_id": "TC_FAKE", "evaluation": evaluation})
+
+
+# Function to split a text into token-like chunks of a few characters
+def tokenize(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+
+        retry_after = server.check_rate_limit()
+        if retry_after:
+            server.count("rate_limited")
+            message = f"Rate limit reached for model `{request.get('model')}`. Please try again in {retry_after:.2f}s."
+            self._send_json(
+                429,
+                {"error": {"message": message, "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after": str(max(int(retry_after), 1))},
+            )
+            return
+
+        with server.lock:
+            malformed = server.rng.random() < server.config.malformed_rate
+            content = make_evaluation(server.rng)
+        if malformed:
+            server.count("malformed")
+            content = content[: len(content) // 2]
+
+        time.sleep(server.config.latency)
+        server.count("requests")
+
+        if self.path == "/api/generate":
+            self._stream_ollama(request, content)
+        elif self.path.endswith("/chat/completions"):
+            self._complete_groq(request, content)
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    # Streams the content token by token as Ollama's /api/generate does
+    def _stream_ollama(self, request, content):
+        tokens = tokenize(content)
+        if request.get("model", "").startswith("deepseek-r1") and not request.get("raw"):
+            thinking = ["<think>", "\n"] + ["hmm "] * self.server.config.think_tokens + ["\n", "</think>", "\n\n"]
+            tokens = thinking + tokens
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        try:
+            for token in tokens:
+                event = {"model": request.get("model"), "response": token, "done": False}
+                self._write_chunk(json.dumps(event).encode("utf-8") + b"\n")
+                if self.server.config.token_latency:
+                    time.sleep(self.server.config.token_latency)
+
+            done_event = {
+                "model": request.get("model"),
+                "response": "",
+                "done": True,
+                "prompt_eval_count": len(request.get("prompt", "")) // 4,
+                "eval_count": len(tokens),
+            }
+            self._write_chunk(json.dumps(done_event).encode("utf-8") + b"\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the generation early
+            self.server.count("cancelled")
+            self.close_connection = True
+
+    # Answers like Groq's chat completions endpoint
+    def _complete_groq(self, request, content):
+        prompt_tokens = sum(len(message.get("content", "")) for message in request.get("messages", [])) // 4
+        completion_tokens = len(tokenize(content))
+        time.sleep(self.server.config.token_latency * completion_tokens)
+
+        self._send_json(200, {
+            "id": f"chatcmpl-fake-{self.server.counters['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "logprobs": None,
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+            "system_fingerprint": "fp_fake",
+        })
+
+
+# ----------------------
+# FAKE LLM HTTP SERVER
+# ----------------------
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeLLMHandler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self._request_times = collections.deque()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # Connections reset by clients cancelling a generation are expected
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    # Returns 0 when the request is within the rate limit, otherwise the
+    # seconds until the oldest request of the window expires
+    def check_rate_limit(self):
+        if not self.config.rate_limit:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            while self._request_times and self._request_times[0] <= now - self.config.rate_window:
+                self._request_times.popleft()
+            if len(self._request_times) >= self.config.rate_limit:
+                return self._request_times[0] + self.config.rate_window - now
+            self._request_times.append(now)
+        return 0
+
+
+# Function to start a fake server in a background thread, on a free port
+# unless one is given. Call `shutdown()` on the returned server when done.
+def start_fake_server(config=None, host="127.0.0.1", port=0):
+    server = FakeLLMServer((host, port), config or FakeServerConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Fake Ollama/Groq server for benchmarks")
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, default=11500)
+    argument_parser.add_argument("--latency", type=float, default=0.05, help="Seconds before the first token")
+    argument_parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between tokens")
+    argument_parser.add_argument("--rate-limit", type=int, default=None, help="Requests per rate window")
+    argument_parser.add_argument("--rate-window", type=float, default=60.0)
+    argument_parser.add_argument("--malformed-rate", type=float, default=0.0)
+    argument_parser.add_argument("--think-tokens", type=int, default=0)
+    argument_parser.add_argument("--seed", type=int, default=0)
+    args = argument_parser.parse_args()
+
+    config = FakeServerConfig(
+        latency=args.latency,
+        token_latency=args.token_latency,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+        malformed_rate=args.malformed_rate,
+        think_tokens=args.think_tokens,
+        seed=args.seed,
+    )
+    server = FakeLLMServer((args.host, args.port), config)
+    print(f"Fake LLM server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Served: {dict(server.counters)}")
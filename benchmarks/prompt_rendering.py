@@ -0,0 +1,65 @@
+import argparse
+import random
+import tempfile
+import time
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.prompts import PromptTemplate
+
+from modules.langchain_helper import PROMPT, get_template, render_prompt
+from modules.prompt_cache import prerender_prompts
+from benchmarks.synthetic_data import generate_test_cases
+from benchmarks.fake_llm_server import make_evaluation
+
+# Micro-benchmark of the prompt stage of an evaluation: the `prompt | model`
+# chain invocation against pre-rendered prompts sent to the model directly.
+# The model is a fake chat model answering instantly, so only the overhead
+# of each path is measured. Usage:
+#
+#   python -m benchmarks.prompt_rendering --cases 2000
+
+
+# Function to time `call` over every input, returns microseconds per call
+def time_per_call(call, inputs):
+    start = time.perf_counter()
+    for item in inputs:
+        call(item)
+    return (time.perf_counter() - start) / len(inputs) * 1e6
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Prompt rendering micro-benchmark")
+    argument_parser.add_argument("--cases", type=int, default=2000)
+    argument_parser.add_argument("--structured", action="store_true")
+    args = argument_parser.parse_args()
+
+    test_cases = generate_test_cases(args.cases)
+    input_variables = [{k: v for k, v in case.items() if k != "group"} for case in test_cases]
+    template = PromptTemplate(input_variables=PROMPT["INPUT_VARIABLES"], template=get_template(args.structured))
+
+    model = FakeListChatModel(responses=[make_evaluation(random.Random(0))])
+    chain = template | model
+
+    results = {
+        "PromptTemplate.invoke": time_per_call(template.invoke, input_variables),
+        "render_prompt": time_per_call(lambda variables: render_prompt(variables, structured=args.structured), input_variables),
+    }
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        prompts = prerender_prompts(test_cases, structured=args.structured, cache_dir=cache_dir)
+        results["prerender (cold cache)"] = (time.perf_counter() - start) / len(test_cases) * 1e6
+
+        start = time.perf_counter()
+        prompts = prerender_prompts(test_cases, structured=args.structured, cache_dir=cache_dir)
+        results["prerender (warm cache)"] = (time.perf_counter() - start) / len(test_cases) * 1e6
+
+    prompt_texts = [prompts[(case["test_case_id"], case["group"])]["prompt"] for case in test_cases]
+    results["chain.invoke (prompt | model)"] = time_per_call(chain.invoke, input_variables)
+    results["model.invoke (pre-rendered)"] = time_per_call(model.invoke, prompt_texts)
+
+    print(f"Prompt stage overhead over {args.cases} test cases (microseconds per case):")
+    for name, micros in results.items():
+        print(f"- {name}: {micros:.1f}")
+    saved = results["chain.invoke (prompt | model)"] - results["model.invoke (pre-rendered)"]
+    print(f"Saved per evaluation by pre-rendering: {saved:.1f} microseconds")
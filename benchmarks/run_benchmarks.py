@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import main
+import groq_main
+from modules.helper import save_data, load_data
+from modules.langchain_helper import get_stream_client
+from modules.quota_ledger import QuotaLedger, MINUTE_WINDOW, DAY_WINDOW
+from modules.records import EvaluationRecord
+from benchmarks.synthetic_data import generate_test_cases
+from benchmarks.fake_llm_server import FakeServerConfig, start_fake_server, make_evaluation
+
+# Throughput, checkpoint and memory benchmarks of the evaluation pipeline,
+# run against the fake LLM server on synthetic test cases. Usage:
+#
+#   python -m benchmarks.run_benchmarks --cases 500 --output bench_results.json
+#   python -m benchmarks.run_benchmarks --cases 500 --baseline bench_results.json
+#
+# With `--baseline` the run fails when the throughput of a pipeline drops by
+# more than `--tolerance` compared to the saved results.
+
+
+# The quota ledger of `groq_main.py` is given limits the fake server never
+# reaches, so the benchmark measures the pipeline rather than the Groq quotas;
+# use `--rate-limit` to exercise the 429 path instead
+BENCHMARK_QUOTA_LIMITS = {MINUTE_WINDOW: (10**9, 10**12), DAY_WINDOW: (10**9, 10**12)}
+
+
+# Context manager timing the checkpoints of an entry point module by wrapping
+# the `save_data` it calls; yields the stats filled in during the run
+@contextlib.contextmanager
+def timed_checkpoints(module):
+    stats = {"checkpoint_writes": 0, "checkpoint_sec": 0.0}
+    save_data_of_module = module.save_data
+
+    def timed_save_data(data, file_path):
+        start = time.perf_counter()
+        save_data_of_module(data, file_path)
+        stats["checkpoint_sec"] += time.perf_counter() - start
+        stats["checkpoint_writes"] += 1
+
+    module.save_data = timed_save_data
+    try:
+        yield stats
+    finally:
+        module.save_data = save_data_of_module
+
+
+# Function to run the evaluation loop of an entry point (`main.py` or
+# `groq_main.py`), with its own deduplication, checkpoints, retries and key
+# selection, and report its throughput. `run(output_dir)` runs the loop and
+# returns its successful and failed records first.
+def run_pipeline(module, run, test_cases, server, output_dir, trace_memory=False):
+    os.makedirs(output_dir, exist_ok=True)
+    counters_before = dict(server.counters)
+
+    if trace_memory:
+        tracemalloc.start()
+    with timed_checkpoints(module) as stats, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        success_jobs, failed_jobs, *_ = run(output_dir)
+        elapsed = time.perf_counter() - start
+
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    counters = {name: server.counters.get(name, 0) - counters_before.get(name, 0) for name in server.counters}
+    return {
+        "cases": len(test_cases),
+        "requests": counters.get("requests", 0),
+        "success": len(success_jobs),
+        "failed": len(failed_jobs),
+        "rate_limited": counters.get("rate_limited", 0),
+        "seconds": round(elapsed, 3),
+        "cases_per_sec": round(len(test_cases) / elapsed, 2),
+        "checkpoint_writes": stats["checkpoint_writes"],
+        "checkpoint_share": round(stats["checkpoint_sec"] / elapsed, 4),
+        "peak_memory_mb": round(peak_memory, 2) if peak_memory is not None else None,
+    }
+
+
+# Benchmark of `main.py`: streaming Ollama client, all test cases
+def bench_ollama(test_cases, server, model_name, output_dir, trace_memory):
+    client = get_stream_client(model_name=model_name, base_url=server.base_url)
+    return run_pipeline(
+        main,
+        lambda results_dir: main.run_evaluation(
+            test_cases,
+            client,
+            results_dir=results_dir,
+            max_cases=None,
+            prompt_cache_dir=f"{results_dir}/prompt_cache",
+            show_progress=False,
+        ),
+        test_cases,
+        server,
+        f"{output_dir}/ollama",
+        trace_memory,
+    )
+
+
+# Benchmark of `groq_main.py`: Groq client pointed at the fake server, with the
+# key selection, quota ledger and key health of the real run
+def bench_groq(test_cases, server, model_name, output_dir, trace_memory):
+    os.environ["GROQ_API_BASE"] = server.base_url
+    os.makedirs(f"{output_dir}/groq", exist_ok=True)
+    ledger = QuotaLedger(f"{output_dir}/groq/quota_ledger.sqlite")
+    try:
+        return run_pipeline(
+            groq_main,
+            lambda results_dir: groq_main.run_evaluation(
+                test_cases,
+                ["gsk_fake_benchmark_key"],
+                model_name,
+                ledger,
+                results_dir=results_dir,
+                quota_limits=BENCHMARK_QUOTA_LIMITS,
+                prompt_cache_dir=f"{results_dir}/prompt_cache",
+                show_progress=False,
+            ),
+            test_cases,
+            server,
+            f"{output_dir}/groq",
+            trace_memory,
+        )
+    finally:
+        ledger.close()
+
+
+# Function to build `count` results shaped like the ones of `evaluate_with_groq`
+def make_results(count, seed=0):
+    rng = random.Random(seed)
+    results = []
+    for index in range(count):
+        result = json.loads(make_evaluation(rng))
+        result.update({
+            "test_case_id": f"TC_{index:05d}",
+            "group": "human-engineers",
+            "evaluated_by": "mixtral-8x7b-32768",
+            "time_taken": {"start_time": "01/01/2025 10:00:00", "end_time": "01/01/2025 10:00:02", "duration_in_sec": 2.0},
+            "usage_metadata": {"input_tokens": 900, "output_tokens": 300, "total_tokens": 1200},
+            "response_metadata": {
+                "token_usage": {"completion_tokens": 300, "prompt_tokens": 900, "total_tokens": 1200},
+                "model_name": "mixtral-8x7b-32768",
+                "system_fingerprint": "fp_fake",
+                "finish_reason": "stop",
+                "logprobs": None,
+            },
+            "output_mode": "structured",
+        })
+        results.append(result)
+    return results
+
+
+# Benchmark of writing a checkpoint of `count` results in each file format
+def bench_checkpoint(count, output_dir):
+    records = [EvaluationRecord(result) for result in make_results(count)]
+    report = {}
+    for extension in (".json", ".jsonl", ".jsonl.gz"):
+        file_path = f"{output_dir}/checkpoint{extension}"
+        start = time.perf_counter()
+        save_data(records, file_path)
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        load_data(file_path)
+        read_time = time.perf_counter() - start
+
+        report[extension] = {
+            "write_sec": round(write_time, 3),
+            "read_sec": round(read_time, 3),
+            "size_kb": os.path.getsize(file_path) // 1024,
+        }
+    return report
+
+
+# Benchmark of the memory held by `count` results, as plain dicts and as
+# compact records
+def bench_memory(count):
+    results = make_results(count)
+
+    def traced_size(build):
+        tracemalloc.start()
+        kept = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return size / 2**20
+
+    dict_size = traced_size(lambda: copy.deepcopy(results))
+    record_size = traced_size(lambda: [EvaluationRecord(result) for result in results])
+    return {
+        "cases": count,
+        "dicts_mb": round(dict_size, 2),
+        "records_mb": round(record_size, 2),
+        "reduction": round(dict_size / record_size, 2),
+    }
+
+
+# Function to compare throughputs with a baseline, returns the regressions found
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for name in ("ollama", "groq"):
+        if name not in results or name not in baseline:
+            continue
+        current, previous = results[name]["cases_per_sec"], baseline[name]["cases_per_sec"]
+        if current < previous * (1 - tolerance):
+            regressions.append(f"{name}: {current} cases/sec vs {previous} in the baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Evaluation pipeline benchmarks")
+    argument_parser.add_argument("--cases", type=int, default=500)
+    argument_parser.add_argument("--duplicate-rate", type=float, default=0.1)
+    argument_parser.add_argument("--latency", type=float, default=0.05)
+    argument_parser.add_argument("--token-latency", type=float, default=0.0)
+    argument_parser.add_argument("--rate-limit", type=int, default=None, help="Requests per rate window")
+    argument_parser.add_argument("--rate-window", type=float, default=1.0)
+    argument_parser.add_argument("--malformed-rate", type=float, default=0.02)
+    argument_parser.add_argument("--ollama-model", default="llama3.2:3b")
+    argument_parser.add_argument("--groq-model", default="mixtral-8x7b-32768")
+    argument_parser.add_argument("--skip", nargs="*", default=[], choices=["ollama", "groq", "checkpoint", "memory"])
+    argument_parser.add_argument("--trace-memory", action="store_true", help="Track peak memory of the pipelines (slower)")
+    argument_parser.add_argument("--output", help="Write the results to this JSON file")
+    argument_parser.add_argument("--baseline", help="Fail on throughput regressions against this results file")
+    argument_parser.add_argument("--tolerance", type=float, default=0.2)
+    args = argument_parser.parse_args()
+
+    test_cases = generate_test_cases(args.cases, duplicate_rate=args.duplicate_rate)
+    server = start_fake_server(FakeServerConfig(
+        latency=args.latency,
+        token_latency=args.token_latency,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+        malformed_rate=args.malformed_rate,
+    ))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        if "ollama" not in args.skip:
+            results["ollama"] = bench_ollama(test_cases, server, args.ollama_model, output_dir, args.trace_memory)
+            print(f"Ollama pipeline: {results['ollama']}")
+        if "groq" not in args.skip:
+            results["groq"] = bench_groq(test_cases, server, args.groq_model, output_dir, args.trace_memory)
+            print(f"Groq pipeline: {results['groq']}")
+        if "checkpoint" not in args.skip:
+            results["checkpoint"] = bench_checkpoint(10000, output_dir)
+            print(f"Checkpoint of 10k results: {results['checkpoint']}")
+        if "memory" not in args.skip:
+            results["memory"] = bench_memory(10000)
+            print(f"Memory of 10k results: {results['memory']}")
+
+    server.shutdown()
+    print(f"Fake server: {dict(server.counters)}")
+
+    if args.output:
+        save_data(results, args.output)
+
+    if args.baseline:
+        regressions = find_regressions(results, load_data(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"   [REGRESSION] - {regression}")
+        if regressions:
+            sys.exit(1)
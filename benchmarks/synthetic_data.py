@@ -0,0 +1,89 @@
+import argparse
+import random
+
+from modules.helper import save_data
+
+# Generates synthetic test cases shaped like `data/cleaned_data.json`, so the
+# evaluation pipeline can be benchmarked without the real dataset. Usage:
+#
+#   python -m benchmarks.synthetic_data --cases 10000 --output data/synthetic_data.json
+
+# Groups of the real dataset, with the approximate share of test cases in each
+GROUPS = {
+    "gpt4-model-chain-of-thought": 314,
+    "gpt4-model-few-shot": 199,
+    "gpt4-model-generate-knowledge": 258,
+    "gpt4-model-meta": 217,
+    "gpt4-model-react": 202,
+    "gpt4-model-self-consistency": 209,
+    "gpt4-model-tree-of-thoughts": 274,
+    "gpt4-model-zero-shot": 191,
+    "human-engineers": 175,
+    "o1-model-chain-of-thought": 502,
+    "o1-model-tree-of-thoughts": 738,
+    "o1-model-zero-shot": 403,
+}
+
+SOFTWARE_NAMES = ["ShopEase", "MediTrack", "EduPortal", "BankSecure", "TravelMate", "FitPulse"]
+MODULES = ["Authentication", "Checkout", "Search", "Profile", "Reporting", "Notifications"]
+SEVERITIES = ["Critical", "High", "Medium", "Low"]
+WORDS = (
+    "user system page field button valid invalid enter verify error message "
+    "displayed login account payment order data input request response should "
+    "when after before successfully redirect email password record update"
+).split()
+
+
+# Function to build a sentence of `length` random words
+def _sentence(rng, length):
+    return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+
+# Function to build a single synthetic test case
+def make_test_case(rng, index, group):
+    software_name = rng.choice(SOFTWARE_NAMES)
+    steps = rng.randint(3, 8)
+    return {
+        "software_name": software_name,
+        "software_desc": _sentence(rng, rng.randint(20, 60)),
+        "test_case_id": f"TC_{index:05d}",
+        "test_module": rng.choice(MODULES),
+        "test_feature": _sentence(rng, 3),
+        "test_case_title": _sentence(rng, rng.randint(5, 10)),
+        "test_case_description": _sentence(rng, rng.randint(15, 40)),
+        "pre_conditions": _sentence(rng, rng.randint(5, 15)),
+        "test_steps": "\n".join(f"{step + 1}. {_sentence(rng, rng.randint(5, 12))}" for step in range(steps)),
+        "test_data": _sentence(rng, rng.randint(3, 10)),
+        "expected_outcome": _sentence(rng, rng.randint(8, 20)),
+        "severity_status": rng.choice(SEVERITIES),
+        "group": group,
+    }
+
+
+# Function to generate `count` test cases spread over the groups like the real
+# dataset. A `duplicate_rate` share of them copies the payload of an earlier
+# test case under a new id and group, exercising the deduplication path.
+def generate_test_cases(count, duplicate_rate=0.0, seed=0):
+    rng = random.Random(seed)
+    groups = rng.choices(list(GROUPS), weights=list(GROUPS.values()), k=count)
+
+    test_cases = []
+    for index, group in enumerate(groups):
+        if test_cases and rng.random() < duplicate_rate:
+            test_case = dict(rng.choice(test_cases), test_case_id=f"TC_{index:05d}", group=group)
+        else:
+            test_case = make_test_case(rng, index, group)
+        test_cases.append(test_case)
+    return test_cases
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Generate synthetic test cases")
+    argument_parser.add_argument("--cases", type=int, default=1000)
+    argument_parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    argument_parser.add_argument("--seed", type=int, default=0)
+    argument_parser.add_argument("--output", default="data/synthetic_data.json")
+    args = argument_parser.parse_args()
+
+    save_data(generate_test_cases(args.cases, args.duplicate_rate, args.seed), args.output)
+    print(f"Generated {args.cases} test cases into {args.output}")
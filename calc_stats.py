@@ -1,13 +1,29 @@
 import json
-from modules.stats_helper import get_descriptive_stats, perform_statistical_tests, format_data_to_evaluations, structuring_stats_in_metrics, create_performance_charts
-from modules.helper import load_data, save_data
+import os
+from modules.stats_helper import get_descriptive_stats, perform_statistical_tests, structuring_stats_in_metrics, create_performance_charts
+from modules.helper import save_data, find_data_file
+from modules.results_db import ResultsDB
+from modules.profiling import start_profiling
 
+# Profile the run when started with `--profile` (see modules/profiling.py)
+start_profiling("data/results/mixtral-8x7b-32768")
 
-# Load data from processed_results.json
-test_cases_scores = load_data("data/evaluations/mixtral-8x7b-32768/archive/processed_results.json")
-print(f"✅ Dataset loaded: {len(test_cases_scores)}")
 
-evaluations = format_data_to_evaluations(test_cases_scores)
+# Sync the indexed results database with processed_results.json (or its
+# compressed processed_results.jsonl.zst/.gz copy); the archive is only read
+# again when it changed since the last run, and the database holds no other
+# results than the archive's
+results_db = ResultsDB("data/evaluations/mixtral-8x7b-32768/results.sqlite")
+synced = results_db.sync_results(
+    find_data_file("data/evaluations/mixtral-8x7b-32768/archive/processed_results.json"), exclusive=True
+)
+print(f"✅ Dataset loaded: {synced} new or updated results")
+
+# Descriptive fields of the test cases (i.e. software_name) for ad-hoc queries
+if os.path.exists("data/cleaned_data.json"):
+    results_db.sync_test_cases("data/cleaned_data.json")
+
+evaluations = results_db.evaluations()
 print(f"✅ Prepared evaluations: {len(evaluations)}")
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+import argparse
+import os
+import socket
+import time
+from tqdm import tqdm
+
+from modules.helper import load_data, save_data, filter_unprocessed_test_cases, get_model_dir, find_data_file
+from modules.langchain_helper import get_stream_client
+from modules.concurrency import AIMDController, run_adaptive, OK, RATE_LIMITED
+from modules.evaluator import evaluate_with_ollama
+from modules.dedup import deduplicate_test_cases, fan_out_result, report_deduplication
+from modules.work_queue import LeaseQueue
+
+# Distributed evaluation over several machines sharing a SQLite work queue
+# (i.e. on a network filesystem). Usage:
+#
+#   python distributed_main.py coordinator enqueue --queue <path> --model <model>
+#   python distributed_main.py worker --queue <path> --model <model> [--ollama-url <url>]
+#   python distributed_main.py coordinator status --queue <path>
+#   python distributed_main.py coordinator merge --queue <path> --model <model>
+
+STRUCTURED_OUTPUT = False
+THINK_TOKEN_BUDGET = 512
+
+
+# Queues every unique, not yet processed test case along with its duplicates
+def enqueue(queue, model_name):
+    all_test_cases = load_data("data/cleaned_data.json")
+    processed_path = find_data_file(f"{get_model_dir(model_name)}/archive/processed_results.json")
+    processed_test_cases = load_data(processed_path) if os.path.exists(processed_path) else []
+
+    test_cases = filter_unprocessed_test_cases(all_test_cases, processed_test_cases)
+
+    # Test cases already queued as the duplicate of another item get its result
+    queued_duplicates = {
+        (case["test_case_id"], case["group"]) for cases in queue.duplicates().values() for case in cases
+    }
+    test_cases = [case for case in test_cases if (case["test_case_id"], case["group"]) not in queued_duplicates]
+
+    unique_test_cases, duplicate_cases = deduplicate_test_cases(test_cases)
+    report_deduplication(test_cases, unique_test_cases)
+
+    print(f"Queued Cases: {queue.enqueue(unique_test_cases, duplicate_cases)}")
+
+
+# Writes the merged results of all workers into the model's result files,
+# copying each result to the duplicates stored with its item when it was queued
+def merge(queue, model_name):
+    success_cases, failed_cases = queue.export_results()
+
+    duplicate_cases = queue.duplicates()
+    success_jobs = []
+    for record in success_cases:
+        success_jobs.append(record)
+        success_jobs.extend(
+            fan_out_result(record, duplicate_cases.get((record["test_case_id"], record["group"]), []))
+        )
+
+    output_dir = get_model_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    save_data(success_jobs, f"{output_dir}/success.json")
+    save_data(failed_cases, f"{output_dir}/failed.json")
+    print(f"Merged Results: Success: {len(success_jobs)}, Failed: {len(failed_cases)}")
+
+
+# Leases batches of test cases and evaluates them until the queue is drained
+def work(queue, model_name, ollama_url, batch_size, worker_id):
+    client = get_stream_client(model_name=model_name, base_url=ollama_url)
+    controller = AIMDController(initial_limit=1, max_limit=8)
+    reasoning_file = f"{get_model_dir(model_name)}/reasoning-{worker_id}.jsonl.gz"
+    os.makedirs(os.path.dirname(reasoning_file), exist_ok=True)
+
+    progress = tqdm(
+        bar_format="[{elapsed}] {n_fmt} | {desc} {rate_fmt}{postfix}",
+        desc=f"Worker {worker_id}",
+        colour="green",
+    )
+
+    while True:
+        lease_token, batch = queue.lease(worker_id, batch_size)
+
+        if not batch:
+            stats = queue.stats()
+            if stats["pending"] == 0 and stats["leased"] == 0:
+                break
+
+            # Other workers still hold leases, wait in case they expire
+            time.sleep(queue.lease_timeout / 10)
+            continue
+
+        def evaluate(test_case):
+            outcome, duration, record = evaluate_with_ollama(
+                test_case,
+                client,
+                structured=STRUCTURED_OUTPUT,
+                think_budget=THINK_TOKEN_BUDGET,
+                reasoning_file=reasoning_file,
+            )
+            if outcome == RATE_LIMITED:
+                queue.release(test_case, lease_token)
+            elif not queue.complete(test_case, lease_token, worker_id, record, failed=outcome != OK):
+                tqdm.write(f"Lease lost for {test_case['test_case_id']} ({test_case['group']}), result dropped")
+            return outcome, duration
+
+        def on_result(test_case, outcome):
+            progress.update(1)
+            return False
+
+        # Keep the lease alive while the batch is being evaluated. Every renewal
+        # is a write transaction on the shared file, so the lease is only renewed
+        # once a third of its timeout has passed
+        last_renewal = time.monotonic()
+
+        def on_tick(remaining):
+            nonlocal last_renewal
+
+            if time.monotonic() - last_renewal >= queue.lease_timeout / 3:
+                queue.renew(lease_token)
+                last_renewal = time.monotonic()
+            progress.set_postfix(controller.state())
+
+        run_adaptive(batch, evaluate, controller, on_result, on_tick)
+
+    progress.close()
+    print(f"Queue drained: {queue.stats()}")
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Distributed test case evaluation")
+    argument_parser.add_argument("role", choices=["coordinator", "worker"])
+    argument_parser.add_argument("action", nargs="?", choices=["enqueue", "status", "merge"], default="status")
+    argument_parser.add_argument("--queue", required=True, help="Path of the shared SQLite queue file")
+    argument_parser.add_argument("--model", default="llama3.2:3b")
+    argument_parser.add_argument("--ollama-url", default="http://localhost:11434")
+    argument_parser.add_argument("--batch-size", type=int, default=20)
+    argument_parser.add_argument("--lease-timeout", type=int, default=600, help="Lease timeout in seconds")
+    argument_parser.add_argument("--max-attempts", type=int, default=3, help="Leases of an item before it is marked as failed")
+    argument_parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+    args = argument_parser.parse_args()
+
+    queue = LeaseQueue(args.queue, lease_timeout=args.lease_timeout, max_attempts=args.max_attempts)
+
+    if args.role == "worker":
+        work(queue, args.model, args.ollama_url, args.batch_size, args.worker_id)
+    elif args.action == "enqueue":
+        enqueue(queue, args.model)
+    elif args.action == "merge":
+        merge(queue, args.model)
+    else:
+        print(queue.stats())
+
+    queue.close()
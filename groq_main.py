@@ -1,45 +1,36 @@
-import time
-import sys
-import os
 import datetime
-
-from modules.langchain_helper import get_groq_chain, parser
-from modules.helper import load_data, chunk_data, save_data, rate_limit_logger, format_time_info, filter_unprocessed_test_cases, wait_for_reset, calculate_tokens
-
-# Importing list of API Keys in order to increase the
-# Rate Limit Per Minute and Day
-from modules.api_keys import api_keys
-
-if len(api_keys) <= 0:
-    print("No API Key Found. Load API Keys list")
-    exit()
-
-
-# Load test cases data
-# 1. Load all test cases
-# 2. Load all processed cases
-# 3. Removing processed cases from all test cases and start the evaluation script
-all_test_cases = load_data("data/cleaned_data.json")
-processed_test_cases = load_data(
-    "data/evaluations/mixtral-8x7b-32768/archive/processed_results.json"
-)
-test_cases = filter_unprocessed_test_cases(all_test_cases, processed_test_cases)
-calculate_tokens(processed_test_cases)
-print(f"\n\nTotal Cases: {len(all_test_cases)}")
-print(f"Processed Cases: {len(processed_test_cases)}")
-print(f"Remaining Cases: {len(test_cases)}\n\n")
-
-if len(test_cases) <= 0:
-    print(
-        "No test case to process. Kindly check if the test cases are all processed or not loaded."
-    )
-    exit()
-
+import os
+from tqdm import tqdm
+
+from modules.concurrency import AIMDController, run_adaptive, OK, RATE_LIMITED
+from modules.evaluator import evaluate_with_groq
+from modules.quota_ledger import QuotaLedger, MINUTE_WINDOW, DAY_WINDOW
+from modules.key_health import NoHealthyKeysError, KEY_ERROR
+from modules.key_pool import ApiKeyPool
+from modules.dedup import deduplicate_test_cases, fan_out_result, report_deduplication
+from modules.records import EvaluationRecord, FailureRecord
+from modules.prompt_cache import prerender_prompts
+from modules.profiling import start_profiling
+from modules.results_db import ResultsDB
+from modules.helper import load_data, save_data, filter_unprocessed_test_cases, calculate_tokens, report_output_mode_savings, get_model_dir, find_data_file
 
 # Initialize chain for evaluation
 models_list = ["llama3-70b-8192", "mixtral-8x7b-32768", "qwen-2.5-32b"]
 active_model = models_list[1]
-active_api_key = 0
+
+# Folder of the evaluation results (and of the quota ledger) of the active model
+RESULTS_DIR = get_model_dir(active_model)
+
+# Structured output mode enables Groq's JSON mode and drops the worked
+# JSON example from the prompt
+# (opt-in: the prompt differs, so results of both modes are not comparable)
+STRUCTURED_OUTPUT = False
+
+# Self-consistency sampling: when set above 1 each test case is evaluated up to
+# this many times in parallel and the scores are aggregated per criterion
+# ("median" or "majority"); sampling stops after two agreeing evaluations
+SELF_CONSISTENCY_SAMPLES = 1
+SELF_CONSISTENCY_METHOD = "median"
 
 # Rate limit constants
 REQUEST_PER_MINUTE = 30
@@ -48,184 +39,146 @@ TOKENS_PER_MINUTE = 5000
 TOKENS_PER_DAY = 500000
 DELAY = 500000
 
-# Initializing tracking variables to handle rate limiting error
-request_made_per_minute = 0
-request_made_per_day = 0
-token_made_per_minute = 0
-token_made_per_day = 0
-
-# Lists to hold successful, unsuccessful and remaining test cases
-# so that we can have the last state if the program crashes
-success_jobs = []
-failed_jobs = []
-remaining_jobs = []
-
-
-# -------------------
-# 3. GROQ CHAIN MAKER
-# -------------------
-# Evaluate a single test case using the specified model.
-def evaluate_test_case(test_case, model_name, api_key):
-    global request_made_per_minute, request_made_per_day
-    global token_made_per_minute, token_made_per_day
-    global success_jobs, failed_jobs
-
-    print("   [DEBUG LOG 1] - Preparing Chain")
-
-    chain = get_groq_chain(model_name, api_key)
-    start_time = datetime.datetime.now()
-    llm_raw_output = ""
-
-    # Prepare input without modifying original test_case
-    input_variables = {k: v for k, v in test_case.items() if k != "group"}
-
-    print("   [DEBUG LOG 2] - Preparing Input Variables")
-
-    try:
-        print("   [DEBUG LOG 3] - Invoking Chain")
-
-        llm_raw_output = chain.invoke(input_variables)
-
-        print("   [DEBUG LOG 4] - LLM Response Success")
-
-        end_time = datetime.datetime.now()
-        content = llm_raw_output.content
-        response_metadata = llm_raw_output.response_metadata
-        usage_metadata = llm_raw_output.usage_metadata
-        parsed_response = parser.parse(content)
-
-        print("   [DEBUG LOG 5] - LLM Response Parsed Success")
-
-        success_case = parsed_response.model_dump()
-
-        # Add metadata
-        success_case.update(
-            {
-                "evaluated_by": model_name,
-                "time_taken": format_time_info(start_time, end_time),
-                "group": test_case["group"],
-                "test_case_id": test_case["test_case_id"],
-                "response_metadata": response_metadata,
-                "usage_metadata": usage_metadata,
-            }
+# Durable quota ledger per API key and model. It survives restarts, and is
+# seeded from the usage of the stored results in case the ledger file is lost,
+# so the run resumes at full safe speed instead of starting from zero.
+QUOTA_LIMITS = {
+    MINUTE_WINDOW: (REQUEST_PER_MINUTE, TOKENS_PER_MINUTE),
+    DAY_WINDOW: (REQUEST_PER_DAY, TOKENS_PER_DAY),
+}
+
+
+# Evaluates the test cases with `model_name`, spreading the requests over the
+# API keys within `quota_limits` as booked in the `ledger`, and saves the
+# results to `results_dir` every 100 test cases and at the end.
+# Returns the successful, failed and remaining records.
+def run_evaluation(
+    test_cases,
+    api_keys,
+    model_name,
+    ledger,
+    results_dir=RESULTS_DIR,
+    quota_limits=QUOTA_LIMITS,
+    prompt_cache_dir="data/prompt_cache",
+    show_progress=True,
+):
+    # Evaluate each unique prompt payload only once, its result is copied to every
+    # test case sharing the same payload (differing only in id or group)
+    test_cases_before_dedup = test_cases
+    test_cases, duplicate_cases = deduplicate_test_cases(test_cases)
+    report_deduplication(test_cases_before_dedup, test_cases)
+    print("\n")
+
+    if len(test_cases) <= 0:
+        print(
+            "No test case to process. Kindly check if the test cases are all processed or not loaded."
         )
-
-        # Update rate limit counters based on usage tokens
-        tokens_used = usage_metadata["total_tokens"]
-        request_made_per_minute += 1
-        request_made_per_day += 1
-        token_made_per_minute += tokens_used
-        token_made_per_day += tokens_used
-
-        success_jobs.append(success_case)
-    except Exception as e:
-        print("   [DEBUG LOG 6] - Exception Occur")
-
-        if "invalid_api_key" in str(e):
-            print(
-                "   [ERROR] - Invalid API Key. Please check your API key configuration."
-            )
-            print("   Test Case ID:", test_case["test_case_id"])
-            print("   API Key:", api_key)
-            sys.exit(1)  # Use sys.exit() with an exit code
-
-        end_time = datetime.datetime.now()
-        failed_case = {
-            "evaluated_by": model_name,
-            "test_case": test_case,
-            "llm_raw_output": llm_raw_output,
-            "error_exception_details": str(e),
-            "time_taken": format_time_info(start_time, end_time),
-        }
-        failed_jobs.append(failed_case)
-
-    print("   [DEBUG LOG 7] - Coming Out from evaluation function")
-
-
-# ===========================================
-# MAIN EXECUTION
-# ===========================================
-total_cases = len(test_cases)
-
-# Looping through test cases
-if total_cases <= 0:
-
-    for i, test_case in enumerate(test_cases):
-        print(f"\nEvaluation of Case No. {i} - {test_case['test_case_id']} - Started")
-
-        # Perform evaluation under rate limita
-        if (
-            request_made_per_minute >= REQUEST_PER_MINUTE
-            or token_made_per_minute >= TOKENS_PER_MINUTE
-        ):
-            # Logging rate limit info
-            rate_limit_logger(
-                "Minute", active_api_key, request_made_per_minute, token_made_per_minute
-            )
-
-            if active_api_key < len(api_keys) - 1:
-                # Rotate to next API key and reset counters
-                active_api_key += 1
-            else:
-                # Resetting active_api_key
-                active_api_key = 0
-
-            # After waiting, reset counters for the current key.
-            request_made_per_minute = 0
-            token_made_per_minute = 0
-
-            # All keys are exhausted; decide whether to wait for minute or day reset.
-            # Here, as a simple approach, we wait for a minute.
-            # wait_for_reset('half-minute')
-
-        elif (
-            request_made_per_day >= REQUEST_PER_DAY
-            or token_made_per_day >= TOKENS_PER_DAY
-        ) and (active_api_key < len(api_keys) - 1):
-            # Logging rate limit info
-            rate_limit_logger(
-                "Minute", active_api_key, request_made_per_day, token_made_per_day
+        return [], [], []
+
+    # Prompts are rendered ahead of the evaluation (and cached on disk), so the
+    # evaluation loop only sends them
+    prompts = prerender_prompts(test_cases, structured=STRUCTURED_OUTPUT, cache_dir=prompt_cache_dir)
+
+    # Lists to hold successful, unsuccessful and remaining test cases
+    # so that we can have the last state if the program crashes
+    success_jobs = []
+    failed_jobs = []
+    remaining_jobs = []
+
+    # Adaptive concurrency controller replacing the fixed 1 sec delay between
+    # requests, it backs off on timeouts and latency spikes (429s are per key and
+    # handled by the key pool)
+    controller = AIMDController(initial_limit=1, max_limit=8)
+
+    # API keys the requests are spread over, within the limits booked in the
+    # ledger. Invalid or exhausted keys are quarantined, rate limited keys are set
+    # aside for a while and keys failing with repeated server errors are skipped,
+    # so the run carries on with the rest of the pool
+    key_pool = ApiKeyPool(api_keys, model_name, ledger, quota_limits)
+
+    # -------------------
+    # 3. GROQ CHAIN MAKER
+    # -------------------
+    # Evaluate a single test case using the specified model.
+    # Returns the outcome of the request and its duration in seconds.
+    def evaluate_test_case(test_case, api_key):
+        # Retries are left to the adaptive controller, which re-queues rate limited cases
+        outcome, duration, record = evaluate_with_groq(
+            test_case,
+            model_name,
+            api_key,
+            structured=STRUCTURED_OUTPUT,
+            samples=SELF_CONSISTENCY_SAMPLES,
+            method=SELF_CONSISTENCY_METHOD,
+            prompt_text=prompts[(test_case["test_case_id"], test_case["group"])]["prompt"],
+        )
+        outcome = key_pool.record_result(api_key, outcome, record)
+
+        if outcome == OK:
+            # Results are kept in memory as compact records until they are saved
+            success_jobs.append(EvaluationRecord(record))
+            success_jobs.extend(
+                EvaluationRecord(duplicate)
+                for duplicate in fan_out_result(record, duplicate_cases[(test_case["test_case_id"], test_case["group"])])
             )
+        elif outcome not in (RATE_LIMITED, KEY_ERROR):
+            # Rate limited cases and the ones failed by their key are queued
+            # again instead of being marked as failed
+            failed_jobs.append(FailureRecord(record))
+
+        return outcome, duration
+
+    total_cases = len(test_cases)
+    processed_cases = 0
+
+    # Looping through test cases
+    progress = tqdm(
+        total=total_cases,
+        bar_format="[{elapsed}<{remaining}] {n_fmt}/{total_fmt} | {l_bar}{bar} {rate_fmt}{postfix}",
+        desc="Evaluating Test Cases",
+        colour="green",
+        disable=not show_progress,
+    )
 
-            if active_api_key < len(api_keys) - 1:
-                # Rotate to next API key and reset counters
-                active_api_key += 1
-            else:
-                # Resetting active_api_key
-                active_api_key = 0
-
-            # After waiting, reset counters for the current key.
-            request_made_per_day = 0
-            token_made_per_day = 0
-
-            # All keys are exhausted; decide whether to wait for minute or day reset.
-            # Here, as a simple approach, we wait for a minute.
-            # wait_for_reset('half-minute')
-
-        # Process the current test case with the active API key
-        current_api_key = api_keys[active_api_key]
-        evaluate_test_case(test_case, active_model, current_api_key)
-
-        print(f"Evaluation of Case No. {i} - {test_case['test_case_id']} - Completed")
+    def on_result(test_case, outcome):
+        nonlocal processed_cases
 
-        # Adding 1 sec delay between each request to avoid spamming
-        time.sleep(1)
+        if outcome in (RATE_LIMITED, KEY_ERROR):
+            return True
 
-        # Get remaining test cases (excluding the current one)
-        remaining_jobs = test_cases[i + 1 :]
+        processed_cases += 1
+        progress.update(1)
 
         # Save results after processing every 100 test case
         # So, that we have the final picture of the cases when the program crash or ends
-        if i % 100 == 0:
-            save_data(success_jobs, "data/evaluations/mixtral-8x7b-32768/success.json")
-            save_data(failed_jobs, "data/evaluations/mixtral-8x7b-32768/failed.json")
-            save_data(
-                remaining_jobs, "data/evaluations/mixtral-8x7b-32768/remaining.json"
-            )
+        if processed_cases % 100 == 0:
+            save_data(success_jobs, f"{results_dir}/success.json")
+            save_data(failed_jobs, f"{results_dir}/failed.json")
+            save_data(remaining_jobs, f"{results_dir}/remaining.json")
+        return False
 
-        # Break after processing the first chunk
-        # if i < 2:
-        #     break
+    # Keep track of the remaining cases and show the controller state
+    def on_tick(remaining):
+        remaining_jobs[:] = remaining
+        progress.set_postfix({**controller.state(), "keys": key_pool.state()})
+
+    try:
+        run_adaptive(
+            test_cases,
+            lambda test_case: evaluate_test_case(test_case, key_pool.select()),
+            controller,
+            on_result,
+            on_tick,
+        )
+    except NoHealthyKeysError:
+        print("\n   [ERROR] - Every API Key is invalid. Please check your API key configuration.")
+    finally:
+        progress.close()
+
+        # Save the final state, including the results since the last checkpoint
+        save_data(success_jobs, f"{results_dir}/success.json")
+        save_data(failed_jobs, f"{results_dir}/failed.json")
+        save_data(remaining_jobs, f"{results_dir}/remaining.json")
 
     print("\n------------")
     print("Final Report")
@@ -233,3 +186,49 @@ if total_cases <= 0:
     print(f"- Remaining: {len(remaining_jobs)} / {total_cases}")
     print(f"- Success: {len(success_jobs)} / {total_cases}")
     print(f"- Failed: {len(failed_jobs)} / {total_cases}")
+    report_output_mode_savings(success_jobs, failed_jobs, f"{results_dir}/output_mode_stats.json")
+    return success_jobs, failed_jobs, remaining_jobs
+
+
+# ===========================================
+# MAIN EXECUTION
+# ===========================================
+if __name__ == "__main__":
+    # Importing list of API Keys in order to increase the
+    # Rate Limit Per Minute and Day
+    from modules.api_keys import api_keys
+
+    if len(api_keys) <= 0:
+        print("No API Key Found. Load API Keys list")
+        exit()
+
+    # Profile the run when started with `--profile` (see modules/profiling.py)
+    start_profiling(RESULTS_DIR)
+
+    # Load test cases data
+    # 1. Load all test cases
+    # 2. Sync the processed cases into the indexed results database (the
+    #    archive is only read again when it changed since the last run)
+    # 3. Removing processed cases from all test cases and start the evaluation script
+    all_test_cases = load_data("data/cleaned_data.json")
+    results_db = ResultsDB(f"{RESULTS_DIR}/results.sqlite")
+    results_db.sync_results(find_data_file(f"{RESULTS_DIR}/archive/processed_results.json"), exclusive=True)
+    test_cases = filter_unprocessed_test_cases(all_test_cases, results_db)
+    calculate_tokens(results_db)
+    print(f"\n\nTotal Cases: {len(all_test_cases)}")
+    print(f"Processed Cases: {len(results_db.processed_keys())}")
+    print(f"Remaining Cases: {len(test_cases)}")
+
+    ledger = QuotaLedger(f"{RESULTS_DIR}/quota_ledger.sqlite")
+    ledger.prune()
+    last_success_path = f"{RESULTS_DIR}/success.json"
+    last_success_jobs = (
+        load_data(last_success_path)
+        if os.path.exists(last_success_path) and os.path.getsize(last_success_path) > 0
+        else []
+    )
+    recent_results = results_db.recent_usage(datetime.datetime.now() - datetime.timedelta(seconds=DAY_WINDOW))
+    print(f"Quota ledger seeded from {ledger.seed_from_results(recent_results + last_success_jobs, active_model)} results\n")
+    results_db.close()
+
+    run_evaluation(test_cases, api_keys, active_model, ledger)
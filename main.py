@@ -1,124 +1,146 @@
 from tqdm import tqdm
-import datetime
-import json
-from modules.helper import load_data, chunk_data, save_data
-from modules.langchain_helper import get_chain, parser
-
-# Load test cases data
-test_cases = load_data('data/cleaned_data.json')
-
-# Chunk test cases data
-tc_chunks = chunk_data(test_cases, 10)
-
-# Initialize chain for evaluation
+from modules.helper import load_data, save_data, report_output_mode_savings
+from modules.langchain_helper import get_stream_client
+from modules.concurrency import AIMDController, run_adaptive, OK, RATE_LIMITED
+from modules.evaluator import evaluate_with_ollama
+from modules.dedup import deduplicate_test_cases, fan_out_result, report_deduplication
+from modules.records import EvaluationRecord, FailureRecord
+from modules.prompt_cache import prerender_prompts
+from modules.profiling import start_profiling
+
+# Initialize streaming client for evaluation
+# (the client stops the generation as soon as the JSON object is complete)
 models_list = ["deepseek-r1:1.5b", "llama3.2:3b", "mistral:7b"]
 active_model = models_list[1]
-chain = get_chain(model_name=active_model)
-
-# Lists to hold successful and unsuccessful test cases
-success_jobs = []
-failed_jobs = []
-
-def evaluate_test_case(test_case, model_name):
-    """
-    Evaluate a single test case using the specified model.
-    """
-    start_time = datetime.datetime.now()
-    llm_raw_output = ""
-    response_dict = {}
-
-    # Remove 'group' from input variables to avoid modifying the original dictionary
-    input_variables = {k: v for k, v in test_case.items() if k != 'group'}
-    
-    try:
-
-        # Invoke the LLM chain
-        llm_raw_output = chain.invoke(input_variables)
-        end_time = datetime.datetime.now()
-
-        # Parse the raw output
-        parsed_response = parser.parse(llm_raw_output)
-        response_dict = parsed_response.model_dump()
-
-        # Add metadata to the response
-        response_dict.update({
-            "time_taken": {
-                "start_time": start_time.strftime("%d/%m/%Y %H:%M:%S"),
-                "end_time": end_time.strftime("%d/%m/%Y %H:%M:%S"),
-                "duration_in_sec": (end_time - start_time).total_seconds(),
-            },
-            "test_case_id": test_case["test_case_id"],
-            "group": test_case["group"],
-            "evaluated_by": model_name,
-        })
-
-        success_jobs.append(response_dict)
-        # print(f"✅ Test case '{test_case['test_case_id']}' of '{test_case['group']}' group evaluated successfully!")
-
-    except Exception as e:
-        end_time = datetime.datetime.now()
-
-        # Prepare failure details
-        failed_case = {
-            "evaluated_by": model_name,
-            "test_case": test_case,
-            "llm_raw_output": llm_raw_output,
-            "error_exception_details": str(e),
-            "time_taken": {
-                "start_time": start_time.strftime("%d/%m/%Y %H:%M:%S"),
-                "end_time": end_time.strftime("%d/%m/%Y %H:%M:%S"),
-                "duration_in_sec": (end_time - start_time).total_seconds(),
-            },
-        }
-
-        failed_jobs.append(failed_case)
-        # print(f"❌ Test case '{test_case['test_case_id']}' of '{test_case['group']}' group evaluation failed!")
-
-
-if chain:
-    # Outer progress bar for chunk processing (yellow)
-    chunk_progress = tqdm(
-        tc_chunks,
+
+# Folder of the evaluation results
+RESULTS_DIR = "data/evaluations"
+
+# Structured output mode constrains the generation to the evaluation JSON schema
+# and drops the worked JSON example from the prompt
+# (opt-in: the prompt differs, so results of both modes are not comparable)
+STRUCTURED_OUTPUT = False
+
+# Reasoning models (i.e. deepseek-r1) think before answering; the think block is
+# capped at this many tokens and stored in a compressed side file instead of
+# being kept inline with the results
+THINK_TOKEN_BUDGET = 512
+REASONING_FILE = "reasoning.jsonl.gz"
+
+# Self-consistency sampling: when set above 1 each test case is evaluated up to
+# this many times in parallel and the scores are aggregated per criterion
+# ("median" or "majority"); sampling stops after two agreeing evaluations
+SELF_CONSISTENCY_SAMPLES = 1
+SELF_CONSISTENCY_METHOD = "median"
+
+
+# Evaluates the test cases with the streaming `chain` client, saving the results
+# to `results_dir` after each test case. Only the first `max_cases` unique test
+# cases are evaluated (all of them when None).
+# Returns the successful and failed records.
+def run_evaluation(test_cases, chain, results_dir=RESULTS_DIR, max_cases=10, prompt_cache_dir="data/prompt_cache", show_progress=True):
+    # Evaluate each unique prompt payload only once, its result is copied to every
+    # test case sharing the same payload (differing only in id or group)
+    unique_test_cases, duplicate_cases = deduplicate_test_cases(test_cases)
+    report_deduplication(test_cases, unique_test_cases)
+    if max_cases is not None:
+        unique_test_cases = unique_test_cases[:max_cases]
+
+    # Prompts are rendered ahead of the evaluation (and cached on disk), so the
+    # evaluation loop only sends them
+    prompts = prerender_prompts(unique_test_cases, structured=STRUCTURED_OUTPUT, cache_dir=prompt_cache_dir)
+
+    # Adaptive concurrency controller, it finds how many parallel requests the
+    # local Ollama server can handle (see OLLAMA_NUM_PARALLEL) without slowing down
+    controller = AIMDController(initial_limit=1, max_limit=8)
+
+    # Lists to hold successful and unsuccessful test cases
+    success_jobs = []
+    failed_jobs = []
+
+    def evaluate_test_case(test_case):
+        """
+        Evaluate a single test case with the streaming client.
+        Returns the outcome of the request and its duration in seconds.
+        """
+        outcome, duration, record = evaluate_with_ollama(
+            test_case,
+            chain,
+            structured=STRUCTURED_OUTPUT,
+            think_budget=THINK_TOKEN_BUDGET,
+            samples=SELF_CONSISTENCY_SAMPLES,
+            method=SELF_CONSISTENCY_METHOD,
+            reasoning_file=f"{results_dir}/{REASONING_FILE}",
+            prompt_text=prompts[(test_case["test_case_id"], test_case["group"])]["prompt"],
+        )
+
+        if outcome == OK:
+            # Results are kept in memory as compact records until they are saved
+            success_jobs.append(EvaluationRecord(record))
+            success_jobs.extend(
+                EvaluationRecord(duplicate)
+                for duplicate in fan_out_result(record, duplicate_cases[(test_case["test_case_id"], test_case["group"])])
+            )
+            # print(f"✅ Test case '{test_case['test_case_id']}' of '{test_case['group']}' group evaluated successfully!")
+        elif outcome != RATE_LIMITED:
+            # Rate limited cases are queued again instead of being marked as failed
+            failed_jobs.append(FailureRecord(record))
+            # print(f"❌ Test case '{test_case['test_case_id']}' of '{test_case['group']}' group evaluation failed!")
+
+        return outcome, duration
+
+    total_test_cases = len(unique_test_cases)
+
+    # Progress bar for test case processing (green)
+    test_case_progress = tqdm(
+        total=total_test_cases,
         bar_format='[{elapsed}<{remaining}] {n_fmt}/{total_fmt} | {l_bar}{bar} {rate_fmt}{postfix}',
-        desc="Processing Chunks",
-        colour='yellow',
-        position=0  # Position 0 for the outer progress bar
+        desc="Evaluating Test Cases",
+        colour='green',
+        disable=not show_progress,
     )
 
-    for chunk_index, chunk in enumerate(chunk_progress, start=1):
-        total_test_cases = len(chunk)
-
-        # Update the outer progress bar description
-        chunk_progress.set_description(f"Processing Chunk {chunk_index}/{len(tc_chunks)}")
+    def on_result(test_case, outcome):
+        if outcome == RATE_LIMITED:
+            return True
+
+        test_case_progress.update(1)
+
+        # Save results after processing each test case
+        save_data(success_jobs, f"{results_dir}/success.json")
+        save_data(failed_jobs, f"{results_dir}/failed.json")
+        return False
+
+    # Show the controller state (limit, in-flight requests, latency) in the progress bar
+    def on_tick(remaining):
+        test_case_progress.set_postfix(controller.state())
+
+    # Perform evaluation of all test cases in a single run under the adaptive
+    # limit, so the worker threads keep their connections to the server
+    run_adaptive(
+        unique_test_cases,
+        evaluate_test_case,
+        controller,
+        on_result,
+        on_tick,
+    )
+    test_case_progress.close()
 
-        # Inner progress bar for test case processing (green)
-        test_case_progress = tqdm(
-            chunk,
-            bar_format='[{elapsed}<{remaining}] {n_fmt}/{total_fmt} | {l_bar}{bar} {rate_fmt}{postfix}',
-            desc=f"Evaluating Test Cases (Chunk {chunk_index})",
-            colour='green',
-            position=1  # Position 1 for the inner progress bar
-        )
+    print(f"Final Report: Success: {len(success_jobs)}/{total_test_cases}, Rejected: {len(failed_jobs)}/{total_test_cases}")
+    report_output_mode_savings(success_jobs, failed_jobs, f"{results_dir}/output_mode_stats.json")
+    return success_jobs, failed_jobs
 
-        for i, test_case in enumerate(test_case_progress, start=1):
-            # Update the inner progress bar description
-            test_case_progress.set_description(f"Evaluating Test Case {i}/{total_test_cases} (Chunk {chunk_index})")
-            
-            # Perform evaluation
-            evaluate_test_case(test_case, active_model)
 
-            # Save results after processing each test case
-            save_data(success_jobs, "data/evaluations/success.json")
-            save_data(failed_jobs, "data/evaluations/failed.json")
+if __name__ == "__main__":
+    # Profile the run when started with `--profile` (see modules/profiling.py)
+    start_profiling(RESULTS_DIR)
 
-        # print(f"Chunk {chunk_index}: Success: {len(success_jobs)}/{total_test_cases}, Rejected: {len(failed_jobs)}/{total_test_cases}")
+    # Load test cases data
+    test_cases = load_data('data/cleaned_data.json')
 
-        # Break after processing the first chunk
-        break
+    chain = get_stream_client(model_name=active_model)
 
-    print(f"Final Report: Success: {len(success_jobs)}/{total_test_cases}, Rejected: {len(failed_jobs)}/{total_test_cases}")
-    
-else:
-    print("Lang-Chain does not initialized.")
-    
-    
\ No newline at end of file
+    if chain:
+        run_evaluation(test_cases, chain)
+    else:
+        print("Lang-Chain does not initialized.")
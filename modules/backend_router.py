@@ -0,0 +1,123 @@
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from modules.concurrency import AIMDController, OK
+
+
+# ----------------------
+# 1. EVALUATION BACKEND
+# ----------------------
+# A backend able to evaluate test cases (i.e. an Ollama host or a Groq model).
+# `evaluate(item)` returns `(outcome, latency)` like for `run_adaptive`. Each
+# backend has its own adaptive concurrency controller, and its routing weight
+# follows the observed latency and error rate, scaled by its capacity weight.
+# A backend that can no longer serve requests (i.e. every API key is invalid)
+# is disabled and gets no more work.
+class Backend:
+    def __init__(self, name, evaluate, weight=1.0, controller=None, smoothing=0.2):
+        self.name = name
+        self.evaluate = evaluate
+        self.capacity_weight = weight
+        self.controller = controller or AIMDController(initial_limit=1, max_limit=8)
+        self.smoothing = smoothing
+
+        self.latency = None
+        self.error_rate = 0.0
+        self.served = 0
+        self.disabled = False
+
+    # Records the outcome of a request served by this backend
+    def observe(self, outcome, latency):
+        failed = 0.0 if outcome == OK else 1.0
+        self.error_rate += self.smoothing * (failed - self.error_rate)
+
+        if outcome == OK:
+            self.served += 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.smoothing * (latency - self.latency)
+
+    # Routing weight: faster and more reliable backends get more work.
+    # Backends without any latency sample yet are treated as taking 1 sec.
+    @property
+    def weight(self):
+        latency = max(self.latency if self.latency is not None else 1.0, 0.1)
+        return self.capacity_weight * max(1.0 - self.error_rate, 0.05) / latency
+
+    def state(self):
+        if self.disabled:
+            return "disabled"
+        return f"{self.controller.in_flight}/{int(self.controller.limit)} w={self.weight:.2f}"
+
+
+# --------------------
+# 2. BACKEND ROUTER
+# --------------------
+# Dispatches a single queue of items to several backends at the same time.
+# Whenever a backend has a free slot under its own concurrency limit it may
+# take the next item; backends are offered items in a weighted random order,
+# so idle backends soak up work while throttled ones are skipped.
+class BackendRouter:
+    def __init__(self, backends):
+        self.backends = backends
+
+    # Weighted random order of the enabled backends (Efraimidis-Spirakis sampling)
+    def _ordered_backends(self):
+        return sorted(
+            [backend for backend in self.backends if not backend.disabled],
+            key=lambda backend: random.random() ** (1.0 / backend.weight),
+            reverse=True,
+        )
+
+    # Evaluates the items over all backends.
+    # `on_result(item, outcome, backend)` runs on the calling thread and returns
+    # True when the item should be queued again (i.e. after a rate limit error);
+    # `on_tick(remaining)` receives the items not finished yet after each poll.
+    # Stops with items left over when every backend has been disabled.
+    def run(self, items, on_result, on_tick=None, poll_interval=0.5):
+        pending = deque(items)
+        futures = {}
+        max_workers = sum(backend.controller.max_limit for backend in self.backends)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or futures:
+                # Each item goes to the first backend, in weighted random order,
+                # that still has a free slot under its concurrency limit
+                while pending:
+                    backend = next(
+                        (backend for backend in self._ordered_backends() if backend.controller.try_acquire()),
+                        None,
+                    )
+                    if backend is None:
+                        break
+
+                    item = pending.popleft()
+                    futures[executor.submit(backend.evaluate, item)] = (item, backend)
+
+                if not futures:
+                    if all(backend.disabled for backend in self.backends):
+                        break
+
+                    # Every backend paused dispatching after a rate limit error
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(futures, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, backend = futures.pop(future)
+                    outcome, latency = future.result()
+                    backend.controller.release(latency, outcome)
+                    backend.observe(outcome, latency)
+
+                    if on_result(item, outcome, backend):
+                        pending.appendleft(item)
+
+                if on_tick:
+                    on_tick([item for item, _ in futures.values()] + list(pending))
+
+    # Current state of every backend, suitable for a progress bar postfix
+    def state(self):
+        return {backend.name: backend.state() for backend in self.backends}
@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import groq
+from langchain_core.exceptions import OutputParserException
+
+# Outcomes reported back to the controller for each finished request
+OK = "ok"
+RATE_LIMITED = "rate_limited"
+TIMEOUT = "timeout"
+ERROR = "error"
+
+
+# Function to classify an exception raised by an LLM call into an outcome.
+# Only the exception type and HTTP status are looked at: the message of a parser
+# error contains the model's output, which may mention anything.
+def classify_exception(exception):
+    if isinstance(exception, OutputParserException):
+        return ERROR
+    if isinstance(exception, groq.RateLimitError) or getattr(exception, "status_code", None) == 429:
+        return RATE_LIMITED
+    # socket.timeout is an alias of TimeoutError
+    if isinstance(exception, (groq.APITimeoutError, TimeoutError)):
+        return TIMEOUT
+    return ERROR
+
+
+# -----------------------------------
+# ADAPTIVE CONCURRENCY (AIMD) CONTROL
+# -----------------------------------
+# Additive-increase / multiplicative-decrease controller for the number of
+# requests in flight. The limit grows by `increase_step` after a full window of
+# successful requests whose latency stays close to the best latency observed,
+# and is multiplied by `decrease_factor` on rate limit errors, timeouts or
+# latency spikes. Rate limit errors additionally pause new dispatches for a
+# short while so the backend can recover.
+class AIMDController:
+    def __init__(
+        self,
+        initial_limit=1,
+        min_limit=1,
+        max_limit=16,
+        increase_step=1,
+        decrease_factor=0.5,
+        latency_spike_factor=2.0,
+        rate_limit_pause=5.0,
+        smoothing=0.2,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.rate_limit_pause = rate_limit_pause
+        self.smoothing = smoothing
+
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.last_event = "start"
+
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Reserves a slot for a new request if the current limit allows it
+    def try_acquire(self):
+        with self._lock:
+            if time.monotonic() < self._paused_until:
+                return False
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    # Frees the slot of a finished request and adapts the limit to its outcome
+    def release(self, latency=None, outcome=OK):
+        with self._lock:
+            self.in_flight -= 1
+
+            if outcome == OK and latency is not None:
+                self._observe_latency(latency)
+
+                if self._is_latency_spike():
+                    self._decrease("latency_spike")
+                else:
+                    self._successes += 1
+                    if self._successes >= int(self.limit):
+                        self.limit = min(self.max_limit, self.limit + self.increase_step)
+                        self._successes = 0
+                        self.last_event = "increase"
+            elif outcome == RATE_LIMITED:
+                self._paused_until = time.monotonic() + self.rate_limit_pause
+                self._decrease(outcome)
+            elif outcome == TIMEOUT:
+                self._decrease(outcome)
+
+    def _observe_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+
+        # The baseline follows the best latency seen, but slowly drifts up so
+        # that a backend which became permanently slower is not punished forever
+        if self.baseline_latency is None or self.latency < self.baseline_latency:
+            self.baseline_latency = self.latency
+        else:
+            self.baseline_latency += 0.01 * (self.latency - self.baseline_latency)
+
+    def _is_latency_spike(self):
+        return self.latency > self.latency_spike_factor * self.baseline_latency
+
+    def _decrease(self, reason):
+        # Requests dispatched before the last decrease report the same
+        # congestion, so only one decrease is applied per latency period
+        now = time.monotonic()
+        if now - self._last_decrease < (self.latency or 0):
+            return
+
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self._successes = 0
+        self._last_decrease = now
+        self.last_event = reason
+
+    # Current controller state, suitable for a progress bar postfix
+    def state(self):
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "latency": f"{self.latency:.1f}s" if self.latency is not None else "-",
+            "event": self.last_event,
+        }
+
+
+# Function to evaluate items concurrently under the controller's limit.
+# `evaluate(item)` runs on a worker thread and returns `(outcome, latency)`;
+# `on_result(item, outcome)` runs on the calling thread and returns True when
+# the item should be queued again (i.e. after a rate limit error);
+# `on_tick(remaining)` receives the items not finished yet after each poll.
+def run_adaptive(items, evaluate, controller, on_result, on_tick=None, poll_interval=0.5):
+    pending = deque(items)
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=controller.max_limit) as executor:
+        while pending or futures:
+            while pending and controller.try_acquire():
+                item = pending.popleft()
+                futures[executor.submit(evaluate, item)] = item
+
+            if not futures:
+                # Dispatching is paused after a rate limit error
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(futures, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = futures.pop(future)
+                outcome, latency = future.result()
+                controller.release(latency, outcome)
+
+                if on_result(item, outcome):
+                    pending.appendleft(item)
+
+            if on_tick:
+                on_tick(list(futures.values()) + list(pending))
@@ -0,0 +1,103 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median_low
+
+# Criteria scored by the model for every test case
+CRITERIA = [
+    "coverage",
+    "clarity",
+    "edge_and_negative_cases_score",
+    "non_functional_coverage",
+]
+
+# Worker threads drawing the samples. The pool is shared by every test case, so
+# its threads (and the connections the streaming client keeps per thread) are
+# reused instead of being set up again for each test case
+SAMPLE_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="consistency")
+
+
+# Function to aggregate a list of scores into a single score.
+# The median is taken as `median_low` so the result stays a valid integer score.
+def aggregate_scores(scores, method="median"):
+    if method == "majority":
+        counts = Counter(scores).most_common()
+        top_count = counts[0][1]
+        tied = [score for score, count in counts if count == top_count]
+        # Ties are broken by the median of the tied scores
+        return median_low(tied)
+    return median_low(scores)
+
+
+# Function to merge several parsed evaluations of the same test case.
+# Each criterion gets the aggregated score and the reason of a sample that gave
+# it; the justification comes from the sample that agrees most with the result.
+# Returns the merged evaluation and the consistency details.
+def aggregate_evaluations(samples, method="median"):
+    merged = {"test_case_id": samples[0]["test_case_id"], "evaluation": {}}
+    scores = {}
+    agreement = {}
+    matches = [0] * len(samples)
+
+    for criterion in CRITERIA:
+        scores[criterion] = [sample["evaluation"][criterion]["score"] for sample in samples]
+        final_score = aggregate_scores(scores[criterion], method)
+
+        agreeing = [i for i, score in enumerate(scores[criterion]) if score == final_score]
+        agreement[criterion] = len(agreeing) / len(samples)
+        for i in agreeing:
+            matches[i] += 1
+
+        reason = samples[agreeing[0]]["evaluation"][criterion]["reason"] if agreeing else None
+        merged["evaluation"][criterion] = {"score": final_score, "reason": reason}
+
+    best_sample = samples[matches.index(max(matches))]
+    merged["evaluation"]["justification"] = best_sample["evaluation"]["justification"]
+
+    consistency = {
+        "samples": len(samples),
+        "method": method,
+        "scores": scores,
+        "agreement": agreement,
+    }
+    return merged, consistency
+
+
+# Function to check whether all samples gave the same score for every criterion
+def samples_agree(samples):
+    return all(
+        len({sample["evaluation"][criterion]["score"] for sample in samples}) == 1
+        for criterion in CRITERIA
+    )
+
+
+# Function to evaluate a test case several times and aggregate the scores.
+# `sample()` performs one evaluation and returns the parsed evaluation dict.
+# The first `min_samples` evaluations run in parallel; when they agree on every
+# criterion sampling stops there, otherwise the remaining samples up to
+# `max_samples` are drawn in parallel as well. Failed samples are skipped, and
+# the first error is raised again only when every sample failed.
+def evaluate_with_consistency(sample, max_samples=3, min_samples=2, method="median"):
+    samples = []
+    errors = []
+
+    def draw(count):
+        futures = [SAMPLE_EXECUTOR.submit(sample) for _ in range(count)]
+        for future in futures:
+            try:
+                samples.append(future.result())
+            except Exception as e:
+                errors.append(e)
+
+    draw(min(min_samples, max_samples))
+
+    if len(samples) < min_samples or not samples_agree(samples):
+        remaining = max_samples - len(samples) - len(errors)
+        if remaining > 0:
+            draw(remaining)
+
+    if not samples:
+        raise errors[0]
+
+    merged, consistency = aggregate_evaluations(samples, method)
+    consistency["failed_samples"] = len(errors)
+    return merged, consistency
@@ -0,0 +1,64 @@
+import copy
+import hashlib
+import json
+
+from modules.langchain_helper import PROMPT
+
+# Fields that make up the prompt of a test case. The test case id is left out
+# because it only labels the case, it is overwritten in the stored result anyway.
+DEDUP_FIELDS = [field for field in PROMPT["INPUT_VARIABLES"] if field != "test_case_id"]
+
+
+# Function to hash the prompt-relevant fields of a test case
+def payload_hash(test_case):
+    payload = {field: test_case.get(field) for field in DEDUP_FIELDS}
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+# Function to keep a single test case per unique payload.
+# Returns the unique test cases and a mapping from the (test_case_id, group)
+# of each kept test case to the duplicates that will share its result.
+def deduplicate_test_cases(test_cases):
+    representatives = {}
+    duplicates = {}
+    unique_cases = []
+
+    for case in test_cases:
+        case_hash = payload_hash(case)
+        if case_hash in representatives:
+            representative = representatives[case_hash]
+            duplicates[(representative["test_case_id"], representative["group"])].append(case)
+        else:
+            representatives[case_hash] = case
+            duplicates[(case["test_case_id"], case["group"])] = []
+            unique_cases.append(case)
+
+    return unique_cases, duplicates
+
+
+# Function to copy the result of an evaluated test case to all its duplicates,
+# recording which test case the evaluation was actually performed for
+def fan_out_result(result, duplicates):
+    fanned_out = []
+    for case in duplicates:
+        duplicate_result = copy.deepcopy(result)
+        duplicate_result.update({
+            "test_case_id": case["test_case_id"],
+            "group": case["group"],
+            "deduplicated_from": {
+                "test_case_id": result["test_case_id"],
+                "group": result["group"],
+            },
+        })
+        fanned_out.append(duplicate_result)
+    return fanned_out
+
+
+# Function to print how many LLM calls the deduplication saves
+def report_deduplication(test_cases, unique_cases):
+    total = len(test_cases)
+    saved = total - len(unique_cases)
+    print(f"Unique Payloads: {len(unique_cases)} / {total}")
+    print(f"LLM Calls Saved: {saved} ({saved / total if total else 0:.2%})")
+    return {"total_cases": total, "unique_payloads": len(unique_cases), "calls_saved": saved}
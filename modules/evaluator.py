@@ -0,0 +1,200 @@
+import datetime
+
+from modules.langchain_helper import get_groq_model, render_prompt, get_generate_options, parser
+from modules.concurrency import classify_exception, OK
+from modules.consistency import evaluate_with_consistency
+from modules.helper import format_time_info, append_compressed_record
+from modules.prompt_cache import estimate_tokens
+
+# Shared evaluation logic of the entry points. Each function evaluates a single
+# test case and returns `(outcome, duration_in_sec, record)` where the record is
+# the success result when the outcome is OK and the failure details otherwise.
+
+
+# Function to return the seconds an API error asked to wait before retrying
+# (the Retry-After header of a 429), or None when it did not say
+def get_retry_after(exception):
+    response = getattr(exception, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after) if retry_after is not None else None
+    except ValueError:
+        return None
+
+
+# Function to prepare the failure details of a test case
+def build_failed_case(test_case, model_name, llm_raw_output, exception, output_mode, start_time, end_time):
+    return {
+        "evaluated_by": model_name,
+        "test_case": test_case,
+        "llm_raw_output": llm_raw_output,
+        "error_exception_details": str(exception),
+        # HTTP status of API errors (i.e. 401, 429, 503), None for other errors
+        "error_status_code": getattr(exception, "status_code", None),
+        "error_retry_after": get_retry_after(exception),
+        "output_mode": output_mode,
+        "time_taken": format_time_info(start_time, end_time),
+    }
+
+
+# Function to draw one or more evaluations with `sample` and aggregate them
+def draw_evaluation(sample, samples=1, method="median"):
+    if samples > 1:
+        evaluation, consistency = evaluate_with_consistency(sample, max_samples=samples, method=method)
+        evaluation["consistency"] = consistency
+        return evaluation
+    return sample()
+
+
+# ------------------
+# 1. OLLAMA BACKEND
+# ------------------
+# Evaluate a single test case with the streaming Ollama client
+def evaluate_with_ollama(
+    test_case,
+    client,
+    structured=False,
+    think_budget=None,
+    samples=1,
+    method="median",
+    reasoning_file=None,
+    prompt_text=None,
+):
+    model_name = client.model_name
+    output_mode = "structured" if structured else "prose"
+    start_time = datetime.datetime.now()
+    generations = []
+
+    # Remove 'group' from input variables to avoid modifying the original dictionary
+    # (the prompt may be rendered once upfront and shared, i.e. by a model sweep)
+    if prompt_text is None:
+        input_variables = {k: v for k, v in test_case.items() if k != 'group'}
+        prompt_text = render_prompt(input_variables, structured=structured)
+
+    # Draw a single evaluation of the test case and parse it
+    def sample():
+        # Stream the LLM output until the JSON object is closed
+        generation = client.generate(
+            prompt_text,
+            think_budget=think_budget,
+            **get_generate_options(structured=structured),
+        )
+        generations.append(generation)
+
+        if generation["reasoning"] and reasoning_file:
+            append_compressed_record({
+                "test_case_id": test_case["test_case_id"],
+                "group": test_case["group"],
+                "evaluated_by": model_name,
+                "think_tokens": generation["think_tokens"],
+                "think_budget_exceeded": generation["think_budget_exceeded"],
+                "reasoning": generation["reasoning"],
+            }, reasoning_file)
+
+        # Parse the raw output
+        return parser.parse(generation["content"]).model_dump()
+
+    try:
+        response_dict = draw_evaluation(sample, samples, method)
+        end_time = datetime.datetime.now()
+
+        # Ollama only reports the prompt tokens in the final event, which is not
+        # received when the generation is stopped early; the prompt is estimated then
+        input_tokens = sum(
+            generation["prompt_eval_count"] if generation["prompt_eval_count"] is not None else estimate_tokens(prompt_text)
+            for generation in generations
+        )
+        output_tokens = sum(generation["eval_count"] for generation in generations)
+
+        # Add metadata to the response
+        response_dict.update({
+            "time_taken": format_time_info(start_time, end_time),
+            "test_case_id": test_case["test_case_id"],
+            "group": test_case["group"],
+            "evaluated_by": model_name,
+            "usage_metadata": {
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+            "terminated_early": all(generation["terminated_early"] for generation in generations),
+            "output_mode": output_mode,
+        })
+        return OK, (end_time - start_time).total_seconds(), response_dict
+
+    except Exception as e:
+        end_time = datetime.datetime.now()
+        llm_raw_output = generations[-1]["content"] if generations else ""
+        failed_case = build_failed_case(
+            test_case, model_name, llm_raw_output, e, output_mode, start_time, end_time
+        )
+        return classify_exception(e), (end_time - start_time).total_seconds(), failed_case
+
+
+# ----------------
+# 2. GROQ BACKEND
+# ----------------
+# Evaluate a single test case with a Groq model. Retries are left to the
+# caller's adaptive controller, so rate limited requests surface immediately.
+def evaluate_with_groq(
+    test_case,
+    model_name,
+    api_key,
+    structured=False,
+    samples=1,
+    method="median",
+    max_retries=0,
+    prompt_text=None,
+):
+    output_mode = "structured" if structured else "prose"
+    model = get_groq_model(model_name, api_key, structured=structured, max_retries=max_retries)
+    start_time = datetime.datetime.now()
+
+    # Render the prompt unless it was pre-rendered, without modifying the original test_case
+    if prompt_text is None:
+        input_variables = {k: v for k, v in test_case.items() if k != "group"}
+        prompt_text = render_prompt(input_variables, structured=structured)
+    responses = []
+
+    # Draw a single evaluation of the test case and parse it
+    def sample():
+        response = model.invoke(prompt_text)
+        responses.append(response)
+        return parser.parse(response.content).model_dump()
+
+    # Token usage adds up over all samples drawn for the test case
+    def total_usage():
+        return {
+            key: sum(response.usage_metadata[key] for response in responses)
+            for key in ("input_tokens", "output_tokens", "total_tokens")
+        }
+
+    try:
+        success_case = draw_evaluation(sample, samples, method)
+        end_time = datetime.datetime.now()
+        usage_metadata = total_usage()
+
+        # Add metadata
+        success_case.update(
+            {
+                "evaluated_by": model_name,
+                "time_taken": format_time_info(start_time, end_time),
+                "group": test_case["group"],
+                "test_case_id": test_case["test_case_id"],
+                "response_metadata": responses[-1].response_metadata,
+                "usage_metadata": usage_metadata,
+                "output_mode": output_mode,
+            }
+        )
+        return OK, (end_time - start_time).total_seconds(), success_case
+
+    except Exception as e:
+        end_time = datetime.datetime.now()
+        llm_raw_output = responses[-1] if responses else ""
+        failed_case = build_failed_case(
+            test_case, model_name, llm_raw_output, e, output_mode, start_time, end_time
+        )
+        # Responses that failed to parse still used tokens of the quota
+        if responses:
+            failed_case["usage_metadata"] = total_usage()
+        return classify_exception(e), (end_time - start_time).total_seconds(), failed_case
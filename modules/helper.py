@@ -1,8 +1,21 @@
+import gzip
 import json
+import os
+import threading
 # import datetime
 from langchain.schema import AIMessage
+from modules.records import EvaluationRecord, FailureRecord
 import time
 
+# zstd support is optional, gzip is used when `zstandard` is not installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed JSON Lines extensions, in order of preference when looking up an archive
+COMPRESSED_EXTENSIONS = (".jsonl.zst", ".jsonl.gz")
+
 class CustomEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, AIMessage):
@@ -11,14 +24,59 @@ class CustomEncoder(json.JSONEncoder):
                 "additional_kwargs": obj.additional_kwargs,
                 "type": "AIMessage"
             }
+        if isinstance(obj, (EvaluationRecord, FailureRecord)):
+            return obj.to_dict()
         return super().default(obj)
 
-# Loads data from a JSON file
+# Opens a data file in text mode, (de)compressing it according to its extension
+def open_data_file(file_path, mode='r'):
+    if file_path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(f"Install `zstandard` to read or write {file_path}")
+        return zstandard.open(file_path, mode + 't', encoding='utf-8')
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, mode + 't', encoding='utf-8', compresslevel=6)
+    return open(file_path, mode, encoding='utf-8')
+
+# Whether the file holds one JSON record per line (i.e. ".jsonl", ".jsonl.gz", ".jsonl.zst")
+def is_jsonl(file_path):
+    return ".jsonl" in os.path.basename(file_path)
+
+# Yields the records of a data file one at a time; JSON Lines files are
+# streamed line by line so they are never held in memory as a whole
+def iter_data(file_path):
+    if not is_jsonl(file_path):
+        yield from load_data(file_path)
+        return
+
+    with open_data_file(file_path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# Loads data from a JSON file, or from a (compressed) JSON Lines file
 def load_data(json_file):
-    with open(json_file) as f:
+    if is_jsonl(json_file):
+        return list(iter_data(json_file))
+
+    with open_data_file(json_file) as f:
         data = json.load(f)
     return data
 
+# Returns the most recently modified of a JSON archive and its compressed JSON
+# Lines counterparts (i.e. "processed_results.jsonl.zst" for
+# "processed_results.json"), so a converted copy left behind does not hide
+# results added to the JSON file since. Returns the given path when none exists.
+def find_data_file(json_file):
+    base_path = json_file.removesuffix(".json")
+    candidates = [json_file] + [
+        base_path + extension
+        for extension in COMPRESSED_EXTENSIONS
+        if extension != ".jsonl.zst" or zstandard is not None
+    ]
+    existing = [file_path for file_path in candidates if os.path.exists(file_path)]
+    return max(existing, key=os.path.getmtime) if existing else json_file
+
 # Chunk large data into smaller pieces
 def chunk_data(data, chunk_size):
     return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
@@ -27,10 +85,35 @@ def chunk_data(data, chunk_size):
 # unsuccessful cases due to any crash (i.e. code, server, internet, etc...)
 # This function is to save each iteration into their respective JSON files 
 # based on successfully and unsuccessfully evaluated state
+#
+# Files with a JSON Lines extension get one compact record per line, written
+# as a stream (compressed for ".gz" and ".zst")
 def save_data(data, file_path):
-    with open(file_path, 'w') as f:
+    if is_jsonl(file_path):
+        with open_data_file(file_path, 'w') as f:
+            for record in data:
+                f.write(json.dumps(record, cls=CustomEncoder) + "\n")
+        return
+
+    with open_data_file(file_path, 'w') as f:
         json.dump(data, f, indent=4, cls=CustomEncoder)
 
+# Lock to keep appends from concurrent evaluations from interleaving
+_append_lock = threading.Lock()
+
+# Appends a single record to a gzip compressed JSON Lines file. Each call adds
+# a new gzip member, which readers decompress transparently as one stream.
+def append_compressed_record(record, file_path):
+    with _append_lock:
+        with gzip.open(file_path, 'at', encoding='utf-8') as f:
+            f.write(json.dumps(record, cls=CustomEncoder) + "\n")
+
+
+# Returns the directory holding the evaluation results of a model; the ':' of
+# Ollama model tags (i.e. "llama3.2:3b") is not allowed in Windows folder names
+def get_model_dir(model_name):
+    return f"data/evaluations/{model_name.replace(':', '-')}"
+
 
 # Return a dictionary with formatted start, end times and duration
 def format_time_info(start, end):
@@ -41,9 +124,13 @@ def format_time_info(start, end):
     }
 
 # Function to filter out already processed test cases
+# (the processed test cases can also be a ResultsDB, read with an indexed query)
 def filter_unprocessed_test_cases(all_test_cases, processed_test_cases):
     # Create a set of (test_case_id, group) tuples for quick lookup
-    processed_set = {(case["test_case_id"], case["group"]) for case in processed_test_cases}
+    if hasattr(processed_test_cases, "processed_keys"):
+        processed_set = processed_test_cases.processed_keys()
+    else:
+        processed_set = {(case["test_case_id"], case["group"]) for case in processed_test_cases}
 
     # Include only those test cases whose (test_case_id, group) is not in the processed_set
     return [
@@ -52,11 +139,19 @@ def filter_unprocessed_test_cases(all_test_cases, processed_test_cases):
     ]
 
 # Function to count no of token utilized
+# (the test cases can also be a ResultsDB, summed with a SQL query)
 def calculate_tokens(test_cases):
     total_input_tokens = 0
     total_output_tokens = 0
     total_tokens = 0
 
+    if hasattr(test_cases, "token_usage"):
+        usage = test_cases.token_usage()
+        total_input_tokens, total_output_tokens, total_tokens = (
+            usage["input_tokens"], usage["output_tokens"], usage["total_tokens"]
+        )
+        test_cases = []
+
     for case in test_cases:
         usage_metadata = case.get("usage_metadata", {})
         total_input_tokens += usage_metadata.get("input_tokens", 0)
@@ -67,6 +162,60 @@ def calculate_tokens(test_cases):
     print(f"total_output_tokens: {total_output_tokens}")
     print(f"total_tokens: {total_tokens}")
 
+# Function to compare token usage and failure rate between output modes
+# ("prose" prompts with a worked JSON example vs. schema "structured" output).
+# A run only uses one mode, so the counts of each run are added to the totals
+# kept in `stats_file` and the report compares every mode seen so far.
+# Copies of a result fanned out to duplicate test cases are not counted.
+def report_output_mode_savings(success_cases, failed_cases, stats_file=None):
+    modes = {}
+    if stats_file and os.path.exists(stats_file) and os.path.getsize(stats_file) > 0:
+        modes = load_data(stats_file)
+
+    for case in success_cases:
+        if isinstance(case, EvaluationRecord):
+            case = case.to_dict()
+        if "deduplicated_from" in case:
+            continue
+        mode = modes.setdefault(case.get("output_mode", "prose"), {"success": 0, "failed": 0, "input": 0, "output": 0})
+        usage_metadata = case.get("usage_metadata") or {}
+        mode["success"] += 1
+        mode["input"] += usage_metadata.get("input_tokens", 0)
+        mode["output"] += usage_metadata.get("output_tokens", 0)
+    for case in failed_cases:
+        if isinstance(case, FailureRecord):
+            case = case.to_dict()
+        mode = modes.setdefault(case.get("output_mode", "prose"), {"success": 0, "failed": 0, "input": 0, "output": 0})
+        mode["failed"] += 1
+
+    if stats_file:
+        save_data(modes, stats_file)
+
+    report = {}
+    for name, mode in modes.items():
+        total = mode["success"] + mode["failed"]
+        report[name] = {
+            "cases": total,
+            "failure_rate": mode["failed"] / total if total else 0,
+            "avg_input_tokens": mode["input"] / mode["success"] if mode["success"] else 0,
+            "avg_output_tokens": mode["output"] / mode["success"] if mode["success"] else 0,
+        }
+        print(
+            f"- {name}: {total} cases | failure rate: {report[name]['failure_rate']:.2%} | "
+            f"avg input tokens: {report[name]['avg_input_tokens']:.0f} | "
+            f"avg output tokens: {report[name]['avg_output_tokens']:.0f}"
+        )
+
+    if "prose" in report and "structured" in report:
+        prose, structured = report["prose"], report["structured"]
+        print(f"- Input tokens saved per case: {prose['avg_input_tokens'] - structured['avg_input_tokens']:.0f}")
+        print(f"- Output tokens saved per case: {prose['avg_output_tokens'] - structured['avg_output_tokens']:.0f}")
+        print(f"- Failure rate change: {structured['failure_rate'] - prose['failure_rate']:+.2%}")
+    else:
+        print("- Run the evaluation in the other output mode to compare both")
+
+    return report
+
 # Function to print rate limit info
 def rate_limit_logger(condition: str, active_api_key: int, request_made: int, token_made: int):
     line = "-" * 30
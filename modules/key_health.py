@@ -0,0 +1,146 @@
+import threading
+import time
+
+from modules.concurrency import RATE_LIMITED, TIMEOUT
+
+# Outcome of a request that failed because of its API key; the test case is
+# queued again and served with another key
+KEY_ERROR = "key_error"
+
+# Key states
+HEALTHY = "healthy"
+OPEN = "open"
+HALF_OPEN = "half_open"
+THROTTLED = "throttled"
+QUARANTINED = "quarantined"
+
+
+# Raised when every API key has been quarantined for good
+class NoHealthyKeysError(Exception):
+    pass
+
+
+# Function to tell apart errors caused by the key from transient server errors,
+# from the outcome of the request (see classify_exception) and the HTTP status
+# of the API error. The message is only read for rate limit errors, where it is
+# the API's own error message and tells a daily quota from a per minute one.
+# Returns "invalid", "exhausted", "transient" or None for unrelated errors.
+def classify_key_error(outcome, status_code=None, message=""):
+    if status_code in (401, 403):
+        return "invalid"
+    if outcome == RATE_LIMITED:
+        message = message.lower()
+        if "per day" in message or "(tpd)" in message or "(rpd)" in message:
+            return "exhausted"
+        return None
+    if (status_code is not None and status_code >= 500) or outcome == TIMEOUT:
+        return "transient"
+    return None
+
+
+# -------------------
+# API KEY HEALTH
+# -------------------
+# Tracks the health of each API key so that a bad key degrades throughput
+# instead of stopping the run:
+# - invalid keys are quarantined for good;
+# - keys whose daily quota is exhausted are quarantined for `exhausted_cooldown`;
+# - keys hitting a per minute rate limit are set aside for as long as the API
+#   asked, or `throttle_cooldown` when it did not say;
+# - each key has a circuit breaker that opens after `failure_threshold`
+#   consecutive transient errors (5xx, timeouts) and lets a single trial request
+#   through once `cooldown` has passed, doubling the cooldown if it fails again.
+class KeyHealth:
+    def __init__(
+        self,
+        key_ids,
+        failure_threshold=3,
+        cooldown=30.0,
+        max_cooldown=600.0,
+        exhausted_cooldown=3600.0,
+        throttle_cooldown=15.0,
+    ):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.exhausted_cooldown = exhausted_cooldown
+        self.throttle_cooldown = throttle_cooldown
+        self._lock = threading.Lock()
+        self._keys = {
+            key_id: {"state": HEALTHY, "failures": 0, "cooldown": cooldown, "until": 0.0, "reason": None}
+            for key_id in key_ids
+        }
+
+    # Whether a request may be sent with the key right now
+    def is_available(self, key_id):
+        with self._lock:
+            key = self._keys[key_id]
+            if key["state"] == HEALTHY:
+                return True
+            if key["state"] in (QUARANTINED, THROTTLED):
+                if key["until"] and time.monotonic() >= key["until"]:
+                    key.update(state=HEALTHY, failures=0, reason=None)
+                    return True
+                return False
+            if key["state"] == OPEN and time.monotonic() >= key["until"]:
+                # Let one trial request through
+                key["state"] = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self, key_id):
+        with self._lock:
+            key = self._keys[key_id]
+            key.update(state=HEALTHY, failures=0, cooldown=self.base_cooldown, reason=None)
+
+    # Sets a key aside for `seconds` after a per minute rate limit error, the
+    # other keys keep serving requests in the meantime
+    def throttle(self, key_id, seconds=None):
+        seconds = seconds if seconds is not None else self.throttle_cooldown
+        with self._lock:
+            key = self._keys[key_id]
+            if key["state"] == HEALTHY:
+                key.update(state=THROTTLED, until=time.monotonic() + seconds, reason="rate limited")
+
+    # Records a failed request; returns the key error kind (see classify_key_error)
+    def record_failure(self, key_id, outcome, status_code=None, message=""):
+        kind = classify_key_error(outcome, status_code, message)
+
+        with self._lock:
+            key = self._keys[key_id]
+            if kind == "invalid":
+                key.update(state=QUARANTINED, until=0.0, reason="invalid key")
+            elif kind == "exhausted":
+                key.update(state=QUARANTINED, until=time.monotonic() + self.exhausted_cooldown, reason="quota exhausted")
+            elif kind == "transient":
+                key["failures"] += 1
+                if key["state"] == HALF_OPEN:
+                    key["cooldown"] = min(key["cooldown"] * 2, self.max_cooldown)
+                if key["state"] == HALF_OPEN or key["failures"] >= self.failure_threshold:
+                    key.update(state=OPEN, until=time.monotonic() + key["cooldown"], reason="repeated server errors")
+
+        return kind
+
+    # Seconds until the first temporarily unavailable key may be tried again,
+    # or None when no key is temporarily unavailable.
+    # Raises NoHealthyKeysError when every key is quarantined for good.
+    def time_until_available(self):
+        with self._lock:
+            if all(key["state"] == QUARANTINED and not key["until"] for key in self._keys.values()):
+                raise NoHealthyKeysError("Every API key is quarantined")
+
+            now = time.monotonic()
+            waits = [
+                max(key["until"] - now, 0.0)
+                for key in self._keys.values()
+                if key["state"] in (OPEN, THROTTLED) or (key["state"] == QUARANTINED and key["until"])
+            ]
+        return min(waits) if waits else None
+
+    # Number of keys per state, suitable for a progress bar postfix
+    def state(self):
+        with self._lock:
+            counts = {}
+            for key in self._keys.values():
+                counts[key["state"]] = counts.get(key["state"], 0) + 1
+        return counts
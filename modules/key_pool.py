@@ -0,0 +1,113 @@
+import threading
+import time
+from tqdm import tqdm
+
+from modules.concurrency import OK, RATE_LIMITED
+from modules.quota_ledger import key_fingerprint, MINUTE_WINDOW
+from modules.key_health import KeyHealth, KEY_ERROR
+from modules.helper import rate_limit_logger
+
+
+# --------------------
+# GROQ API KEY POOL
+# --------------------
+# Spreads the requests of a Groq model over several API keys. Each request is
+# booked in the quota `ledger` against the key that served it, and the health of
+# every key is tracked (see KeyHealth), so a bad or rate limited key is set
+# aside while the rest of the pool keeps serving requests.
+class ApiKeyPool:
+    def __init__(self, api_keys, model_name, ledger, quota_limits, key_health=None):
+        self.api_keys = api_keys
+        self.model_name = model_name
+        self.ledger = ledger
+        self.quota_limits = quota_limits
+        self.key_ids = [key_fingerprint(api_key) for api_key in api_keys]
+        self.key_health = key_health or KeyHealth(self.key_ids)
+
+        # Lock guarding the active API key, which is shared by the concurrent evaluations
+        self._lock = threading.Lock()
+        self._active = 0
+
+    # Picks the API key for the next request. The active key is kept as long as
+    # it is healthy and its ledger shows room in the per minute and per day
+    # windows, otherwise the next such key is used; when no key is usable this
+    # waits until the first one frees up. The request is booked in the ledger
+    # right away so concurrent dispatches see each other.
+    # Raises NoHealthyKeysError once every key has been quarantined for good.
+    def select(self):
+        while True:
+            waits = []
+            with self._lock:
+                for offset in range(len(self.api_keys)):
+                    index = (self._active + offset) % len(self.api_keys)
+                    wait = self.ledger.wait_time(self.key_ids[index], self.model_name, self.quota_limits)
+                    if wait == 0 and self.key_health.is_available(self.key_ids[index]):
+                        if index != self._active:
+                            # Logging rate limit info
+                            requests, tokens = self.ledger.usage(self.key_ids[self._active], self.model_name, MINUTE_WINDOW)
+                            rate_limit_logger("Minute", self._active, requests, tokens)
+                            self._active = index
+
+                        self.ledger.record(self.key_ids[index], self.model_name, 0)
+                        return self.api_keys[index]
+                    if wait > 0:
+                        waits.append(wait)
+
+                health_wait = self.key_health.time_until_available()
+                if health_wait is not None:
+                    waits.append(health_wait)
+
+            # No key is usable right now; wait until the first one has room again
+            time.sleep(max(min(waits, default=1.0), 0.1))
+
+    # Books the usage of a finished request served with `api_key` and updates the
+    # key's health from its outcome and record (see evaluate_with_groq).
+    # Returns the outcome to report, KEY_ERROR when the key itself was at fault
+    # (invalid, exhausted or rate limited key) so the test case goes to another key.
+    def record_result(self, api_key, outcome, record):
+        key_id = key_fingerprint(api_key)
+
+        if outcome == OK:
+            # Book the tokens used (and any extra self-consistency requests) in the
+            # ledger; the first request was booked when the key was selected
+            consistency = record.get("consistency")
+            requests_made = consistency["samples"] + consistency["failed_samples"] if consistency else 1
+            record["api_key_id"] = key_id
+            self.ledger.record(
+                key_id,
+                self.model_name,
+                record["usage_metadata"]["total_tokens"],
+                requests=requests_made - 1,
+                event_id=f"{record['test_case_id']}:{record['group']}:{record['time_taken']['end_time']}",
+            )
+            self.key_health.record_success(key_id)
+            return outcome
+
+        # Responses that failed to parse used tokens too
+        if "usage_metadata" in record:
+            self.ledger.record(key_id, self.model_name, record["usage_metadata"]["total_tokens"], requests=0)
+
+        error_kind = self.key_health.record_failure(
+            key_id, outcome, record["error_status_code"], record["error_exception_details"]
+        )
+
+        if error_kind == "invalid":
+            tqdm.write(
+                f"   [ERROR] - Invalid API Key {key_id} quarantined. Please check your API key configuration."
+            )
+            return KEY_ERROR
+        if error_kind == "exhausted":
+            return KEY_ERROR
+        if outcome == RATE_LIMITED:
+            # Groq's per minute limits are per key, so only this key backs off,
+            # for as long as the API asked
+            self.key_health.throttle(key_id, record.get("error_retry_after"))
+            return KEY_ERROR
+        if error_kind is None:
+            # The API answered, so the key itself is fine
+            self.key_health.record_success(key_id)
+        return outcome
+
+    # Number of keys per state, suitable for a progress bar postfix
+    def state(self):
+        return self.key_health.state()
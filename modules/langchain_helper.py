@@ -1,9 +1,9 @@
-from langchain.prompts import PromptTemplate
-from langchain_ollama.llms import OllamaLLM
+from functools import lru_cache
 from langchain_groq import ChatGroq
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field, field_validator
 from typing import Optional
+from modules.ollama_stream import OllamaStreamClient, OLLAMA_BASE_URL
 
 # ----------------------------
 # 1. PYDANTIC MODEL DEFINITION
@@ -144,40 +144,60 @@ PROMPT = {
     """,
 }
 
-# Initializing the PromptTemplate with input variables and partial variables
-prompt = PromptTemplate(
-    input_variables=PROMPT["INPUT_VARIABLES"],
-    template=PROMPT["TEMPLATE"],
-    partial_variables={"format_instructions": parser.get_format_instructions()}
-)
-
-# ---------------------
-# 2. OLLAMA CHAIN MAKER
-# ---------------------
-# Function to return the chain after chaining of prompt and model
-def get_chain(model_name="llama3.2:3b"):
-    # Loading model
-    model = OllamaLLM(model=model_name)
-
-    # Chaining the prompt and model
-    chain = prompt | model
-
-    return chain
+# Structured output mode relies on the backend to enforce the JSON schema,
+# so the worked JSON example is replaced by a short output instruction
+PROMPT["STRUCTURED_TEMPLATE"] = PROMPT["TEMPLATE"].split("**JSON format Output:**")[0] + """**JSON format Output:**
+    Respond with a single JSON object containing "test_case_id" ("{test_case_id}") and an
+    "evaluation" with "coverage", "clarity", "edge_and_negative_cases_score" and
+    "non_functional_coverage" (each with an integer "score" from 1 to 5 and a "reason"),
+    followed by an overall "justification".
+    """
 
+# JSON schema of the expected output, passed to backends supporting constrained decoding
+EVALUATION_SCHEMA = TestCaseEvaluation.model_json_schema()
 
 # -------------------
-# 3. GROQ CHAIN MAKER
+# 2. GROQ CHAIN MAKER
 # -------------------
-# Function to return the chain after chaining of prompt and model
-def get_groq_chain(model_name, api_key):
+# Function to return the Groq chat model, it is invoked directly with a
+# prompt rendered by `render_prompt`.
+# In structured mode Groq's JSON mode is enabled. Models are cached per
+# arguments, so every request with the same key reuses the model's HTTP clients
+# (and their keep-alive connections) instead of building new ones
+@lru_cache(maxsize=None)
+def get_groq_model(model_name, api_key, structured=False, max_retries=2):
+    model_kwargs = {"response_format": {"type": "json_object"}} if structured else {}
+
     # Loading model
-    model = ChatGroq(api_key=api_key, 
-                     model=model_name, 
-                     max_tokens=500, 
-                     max_retries=2)
+    return ChatGroq(api_key=api_key, 
+                    model=model_name, 
+                    max_tokens=500, 
+                    max_retries=max_retries,
+                    model_kwargs=model_kwargs)
+
+
+# ---------------------------------
+# 3. OLLAMA STREAMING CLIENT MAKER
+# ---------------------------------
+# Function to return a streaming client that stops the generation as soon
+# as the JSON object is complete. Prompts are rendered with `render_prompt`.
+def get_stream_client(model_name="llama3.2:3b", base_url=OLLAMA_BASE_URL, keep_alive=None):
+    return OllamaStreamClient(model_name=model_name, base_url=base_url, keep_alive=keep_alive)
+
+
+# Function to return the template text of the given output mode
+def get_template(structured=False):
+    return PROMPT["STRUCTURED_TEMPLATE"] if structured else PROMPT["TEMPLATE"]
+
 
-    # Chaining the prompt and model
-    chain = prompt | model
+# Function to render the evaluation prompt for a single test case. The template
+# is formatted directly, giving the same text as a langchain PromptTemplate
+# without its per-call input validation
+def render_prompt(input_variables, structured=False):
+    return get_template(structured).format(**input_variables)
 
-    return chain
 
+# Keyword arguments for `OllamaStreamClient.generate` in the given output mode,
+# structured mode constrains the generation to the evaluation JSON schema
+def get_generate_options(structured=False):
+    return {"format": EVALUATION_SCHEMA} if structured else {}
@@ -0,0 +1,298 @@
+import http.client
+import json
+import threading
+from urllib.parse import urlparse
+
+# Default address of the local Ollama server
+OLLAMA_BASE_URL = "http://localhost:11434"
+
+
+# Raised when Ollama answers a request with an HTTP error status
+class OllamaHTTPError(RuntimeError):
+    def __init__(self, status_code, body):
+        super().__init__(f"Ollama returned HTTP {status_code}: {body}")
+        self.status_code = status_code
+
+
+# -----------------------------
+# 1. INCREMENTAL JSON TRACKER
+# -----------------------------
+# Tracks the first top-level JSON object in a token stream so that the
+# generation can be cancelled as soon as the object is closed, instead of
+# waiting for the model to finish the prose it often adds after the JSON.
+class JsonObjectTracker:
+    def __init__(self):
+        self.raw = ""
+        self.depth = 0
+        self.start = -1
+        self.end = -1
+        self.in_string = False
+        self.escaped = False
+
+    @property
+    def closed(self):
+        return self.end != -1
+
+    # Returns the JSON object text once closed, otherwise the raw text so far
+    @property
+    def text(self):
+        if self.closed:
+            return self.raw[self.start:self.end]
+        return self.raw
+
+    # Feeds a chunk of generated text, returns True once the object is closed
+    def feed(self, chunk):
+        offset = len(self.raw)
+        self.raw += chunk
+
+        if self.closed:
+            return True
+
+        for i, char in enumerate(chunk, start=offset):
+            if self.start == -1:
+                if char == "{":
+                    self.start = i
+                    self.depth = 1
+                continue
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = i + 1
+                    return True
+
+        return False
+
+
+# ------------------------
+# 2. THINK BLOCK FILTER
+# ------------------------
+# Reasoning models (e.g. deepseek-r1) emit a `<think>...</think>` section
+# before the answer. This filter separates the reasoning from the answer while
+# streaming, even when the tags are split across several tokens.
+class ThinkBlockFilter:
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.reasoning = ""
+        self.in_think = False
+        self.done = False
+        self._pending = ""
+
+    # Feeds a chunk of generated text, returns the part belonging to the answer
+    def feed(self, chunk):
+        buffer = self._pending + chunk
+        self._pending = ""
+
+        if self.done:
+            return buffer
+
+        if not self.in_think:
+            stripped = buffer.lstrip()
+            if stripped.startswith(self.OPEN_TAG):
+                self.in_think = True
+                buffer = stripped[len(self.OPEN_TAG):]
+            elif self.OPEN_TAG.startswith(stripped):
+                # Not enough text yet to tell whether a think block starts
+                self._pending = buffer
+                return ""
+            else:
+                self.done = True
+                return buffer
+
+        close_index = buffer.find(self.CLOSE_TAG)
+        if close_index != -1:
+            self.reasoning += buffer[:close_index]
+            self.in_think = False
+            self.done = True
+            return buffer[close_index + len(self.CLOSE_TAG):]
+
+        # Hold back a trailing partial closing tag until the next chunk
+        for size in range(min(len(self.CLOSE_TAG) - 1, len(buffer)), 0, -1):
+            if self.CLOSE_TAG.startswith(buffer[-size:]):
+                self._pending = buffer[-size:]
+                buffer = buffer[:-size]
+                break
+
+        self.reasoning += buffer
+        return ""
+
+
+# Chat template markers of reasoning models, used to resume a generation in raw
+# mode with a closed think block once the thinking-token budget is exhausted
+REASONING_MODELS = {
+    "deepseek-r1": {"user": "<｜User｜>", "assistant": "<｜Assistant｜>"},
+}
+
+
+# Function to check whether a model emits think blocks
+def is_reasoning_model(model_name):
+    return model_name.split(":")[0] in REASONING_MODELS
+
+
+# ----------------------------
+# 3. STREAMING OLLAMA CLIENT
+# ----------------------------
+# Lightweight client for Ollama's `/api/generate` endpoint. Connections are
+# kept alive per thread and reused across calls; a connection is only dropped
+# when a generation is cancelled early, which is also what makes Ollama stop
+# spending GPU/CPU time on the remaining tokens.
+class OllamaStreamClient:
+    def __init__(self, model_name, base_url=OLLAMA_BASE_URL, timeout=300, options=None, keep_alive=None):
+        parsed_url = urlparse(base_url)
+        self.model_name = model_name
+        self.keep_alive = keep_alive
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or 80
+        self.timeout = timeout
+        self.options = options or {}
+        self._local = threading.local()
+
+    def _get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _post(self, payload):
+        body = json.dumps(payload)
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+        # A kept-alive connection may have been closed by the server meanwhile,
+        # so retry once on a fresh connection before giving up
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                connection.request("POST", "/api/generate", body=body, headers=headers)
+                return connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                self._drop_connection()
+                if attempt == 1:
+                    raise
+
+    # Streams the response of a single request into the tracker and filter.
+    # Returns "closed", "done" or "think_budget" depending on why it stopped.
+    def _stream(self, payload, tracker, think_filter, think_budget, result):
+        response = self._post(payload)
+        if response.status != 200:
+            error_body = response.read().decode("utf-8", errors="replace")
+            raise OllamaHTTPError(response.status, error_body)
+
+        status = "done"
+        try:
+            for line in response:
+                if not line.strip():
+                    continue
+
+                event = json.loads(line)
+                if "error" in event:
+                    raise RuntimeError(f"Ollama error: {event['error']}")
+
+                # Each streamed event carries a single generated token
+                token = event.get("response", "")
+                if token:
+                    result["eval_count"] += 1
+                    if think_filter.in_think:
+                        result["think_tokens"] += 1
+
+                closed = tracker.feed(think_filter.feed(token))
+
+                if event.get("done"):
+                    result["prompt_eval_count"] = (result["prompt_eval_count"] or 0) + event.get("prompt_eval_count", 0)
+                    break
+
+                if closed:
+                    status = "closed"
+                    break
+
+                if think_budget is not None and result["think_tokens"] >= think_budget:
+                    status = "think_budget"
+                    break
+        except Exception:
+            self._drop_connection()
+            raise
+
+        if status == "done":
+            # Drain whatever is left so the connection can be reused
+            response.read()
+        else:
+            # Closing the socket cancels the remaining generation on the server
+            self._drop_connection()
+
+        return status
+
+    # Streams a generation and stops it once the top-level JSON object closes.
+    # For reasoning models the think block is kept out of the answer and, once
+    # `think_budget` tokens were spent thinking, the generation is resumed with
+    # the truncated reasoning closed off so the model moves on to the answer.
+    # Returns the extracted JSON text along with the raw output and token counts.
+    def generate(self, prompt, think_budget=None, **payload_overrides):
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": True,
+            "options": self.options,
+        }
+        if self.keep_alive is not None:
+            # How long Ollama keeps the model loaded after the request (i.e. "30m")
+            payload["keep_alive"] = self.keep_alive
+        payload.update(payload_overrides)
+
+        if not is_reasoning_model(self.model_name):
+            think_budget = None
+
+        tracker = JsonObjectTracker()
+        think_filter = ThinkBlockFilter()
+        result = {
+            "content": "",
+            "raw": "",
+            "reasoning": "",
+            "terminated_early": False,
+            "think_budget_exceeded": False,
+            # Only reported in the final event, so None when stopped early
+            "prompt_eval_count": None,
+            "eval_count": 0,
+            "think_tokens": 0,
+        }
+
+        status = self._stream(payload, tracker, think_filter, think_budget, result)
+
+        if status == "think_budget":
+            result["think_budget_exceeded"] = True
+            markers = REASONING_MODELS[self.model_name.split(":")[0]]
+            think_filter.in_think = False
+            think_filter.done = True
+
+            # Raw mode bypasses the chat template, so it is applied by hand
+            payload["raw"] = True
+            payload["prompt"] = (
+                f"{markers['user']}{prompt}{markers['assistant']}"
+                f"{ThinkBlockFilter.OPEN_TAG}\n{think_filter.reasoning.strip()}\n"
+                f"{ThinkBlockFilter.CLOSE_TAG}\n\n"
+            )
+            status = self._stream(payload, tracker, think_filter, None, result)
+
+        result["terminated_early"] = status == "closed"
+        result["content"] = tracker.text
+        result["raw"] = tracker.raw
+        result["reasoning"] = think_filter.reasoning.strip()
+        return result
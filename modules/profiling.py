@@ -0,0 +1,169 @@
+import argparse
+import atexit
+import collections
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+
+# Function to describe a frame in a flamegraph stack (no ";" allowed in names)
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+# -------------------
+# OPT-IN PROFILER
+# -------------------
+# Profiles a run of an entry point and writes the results to `output_dir`:
+# - "sampling" mode samples the stacks of every thread each `sample_interval`
+#   seconds with little overhead and writes them in the folded format read by
+#   flamegraph.pl, speedscope and inferno (`profile.folded`);
+# - "cprofile" mode traces every call of the main thread with cProfile
+#   (`profile.prof`, readable with pstats or snakeviz, and a summary in
+#   `profile.txt`), suited to single threaded scripts such as calc_stats.py;
+# - unless `snapshot_interval` is 0, tracemalloc snapshots are taken every
+#   `snapshot_interval` seconds and the top allocation sites, with their growth
+#   since the previous snapshot, are appended to `allocations.txt`.
+class Profiler:
+    def __init__(self, output_dir, mode="sampling", sample_interval=0.005, snapshot_interval=60.0, top=25):
+        self.output_dir = output_dir
+        self.mode = mode
+        self.sample_interval = sample_interval
+        self.snapshot_interval = snapshot_interval
+        self.top = top
+        self._stacks = collections.Counter()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._profile = None
+        self._previous_snapshot = None
+        self._started = False
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._started = True
+        self._start_time = time.perf_counter()
+
+        if self.snapshot_interval:
+            tracemalloc.start(10)
+            self._threads.append(threading.Thread(target=self._snapshot_loop, daemon=True))
+
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._threads.append(threading.Thread(target=self._sample_loop, daemon=True))
+
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    # Records the current stack of every thread but the profiler's own
+    def _sample_loop(self):
+        own_threads = {thread.ident for thread in self._threads}
+        thread_names = {}
+
+        while not self._stop_event.wait(self.sample_interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in own_threads:
+                    continue
+                if thread_id not in thread_names:
+                    # Pool workers (i.e. "ThreadPoolExecutor-0_3") are merged into one root
+                    thread_names = {
+                        thread.ident: re.sub(r"_\d+$", "", thread.name) for thread in threading.enumerate()
+                    }
+
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, "thread").replace(";", ","))
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def _snapshot_loop(self):
+        while not self._stop_event.wait(self.snapshot_interval):
+            self._write_allocations()
+
+    # Appends the top allocation sites of a new snapshot to `allocations.txt`
+    def _write_allocations(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        elapsed = time.perf_counter() - self._start_time
+
+        lines = [
+            f"=== {datetime.datetime.now():%d/%m/%Y %H:%M:%S} (+{elapsed:.0f}s) | "
+            f"traced: {current / 2**20:.1f} MB | peak: {peak / 2**20:.1f} MB ===",
+            f"Top {self.top} allocation sites:",
+        ]
+        lines += [f"  {stat}" for stat in snapshot.statistics("lineno")[:self.top]]
+
+        if self._previous_snapshot is not None:
+            lines.append(f"Top {self.top} growths since the previous snapshot:")
+            lines += [f"  {stat}" for stat in snapshot.compare_to(self._previous_snapshot, "lineno")[:self.top]]
+        self._previous_snapshot = snapshot
+
+        with open(f"{self.output_dir}/allocations.txt", "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n\n")
+
+    # Stops profiling and writes the results; safe to call more than once
+    def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(f"{self.output_dir}/profile.prof")
+            summary = io.StringIO()
+            pstats.Stats(self._profile, stream=summary).sort_stats("cumulative").print_stats(50)
+            with open(f"{self.output_dir}/profile.txt", "w", encoding="utf-8") as f:
+                f.write(summary.getvalue())
+        else:
+            with open(f"{self.output_dir}/profile.folded", "w", encoding="utf-8") as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        if self.snapshot_interval:
+            self._write_allocations()
+            tracemalloc.stop()
+
+        print(f"Profile written to {self.output_dir}")
+
+
+# Function to start a profiler when the script is run with `--profile`. Other
+# command line arguments are left alone. The profile is written to a
+# timestamped folder under `<results_dir>/profile/` when the script exits.
+# Returns the running profiler, or None when profiling is off.
+def start_profiling(results_dir, argv=None):
+    argument_parser = argparse.ArgumentParser(add_help=False)
+    argument_parser.add_argument("--profile", nargs="?", const="sampling", choices=["sampling", "cprofile"])
+    argument_parser.add_argument("--profile-sample-interval", type=float, default=0.005, help="Seconds between stack samples")
+    argument_parser.add_argument("--profile-interval", type=float, default=60.0, help="Seconds between tracemalloc snapshots, 0 to disable")
+    args, _ = argument_parser.parse_known_args(argv)
+
+    if not args.profile:
+        return None
+
+    output_dir = f"{results_dir}/profile/{datetime.datetime.now():%Y%m%d-%H%M%S}"
+    profiler = Profiler(
+        output_dir,
+        mode=args.profile,
+        sample_interval=args.profile_sample_interval,
+        snapshot_interval=args.profile_interval,
+    ).start()
+    atexit.register(profiler.stop)
+    return profiler
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from modules.helper import iter_data, save_data
+from modules.langchain_helper import PROMPT, get_template
+
+# Below this many prompts to render, rendering in the current process is
+# faster than starting worker processes
+PARALLEL_THRESHOLD = 20000
+
+
+# Function to hash a template, the cache of its prompts is stored under it
+def template_hash(template):
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+
+# Function to hash the input variables of a test case
+def input_hash(test_case):
+    payload = json.dumps({field: test_case[field] for field in PROMPT["INPUT_VARIABLES"]}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Estimated number of tokens of a text (about 4 characters per token for
+# English text with the tokenizers of the supported models)
+def estimate_tokens(text):
+    return max(1, round(len(text) / 4))
+
+
+# Renders a chunk of test cases; module level so worker processes can run it
+def _render_chunk(template, test_cases):
+    rendered = []
+    for test_case in test_cases:
+        prompt_text = template.format(**{field: test_case[field] for field in PROMPT["INPUT_VARIABLES"]})
+        rendered.append({"key": input_hash(test_case), "prompt": prompt_text, "tokens": estimate_tokens(prompt_text)})
+    return rendered
+
+
+# -----------------------
+# PRE-RENDERED PROMPTS
+# -----------------------
+# Renders the prompts of the test cases ahead of the evaluation, with their
+# estimated token counts, and caches them on disk in a file named after the
+# template hash; editing the template therefore starts a fresh cache. Prompts
+# already in the cache are not rendered again, the others are rendered in
+# worker processes when there are many of them.
+# Returns a dict of {(test_case_id, group): {"prompt": ..., "tokens": ...}}.
+def prerender_prompts(test_cases, structured=False, cache_dir="data/prompt_cache", processes=None):
+    template = get_template(structured)
+    cache_path = f"{cache_dir}/{template_hash(template)}.jsonl.gz"
+
+    cache = {}
+    if os.path.exists(cache_path):
+        cache = {entry["key"]: entry for entry in iter_data(cache_path)}
+
+    keys = [input_hash(test_case) for test_case in test_cases]
+    missing = list({key: test_case for key, test_case in zip(keys, test_cases) if key not in cache}.values())
+
+    if missing:
+        if len(missing) >= PARALLEL_THRESHOLD:
+            processes = processes or os.cpu_count() or 1
+            chunk_size = -(-len(missing) // processes)
+            chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                rendered = [entry for chunk in executor.map(_render_chunk, [template] * len(chunks), chunks) for entry in chunk]
+        else:
+            rendered = _render_chunk(template, missing)
+
+        cache.update((entry["key"], entry) for entry in rendered)
+        os.makedirs(cache_dir, exist_ok=True)
+        save_data(list(cache.values()), cache_path)
+
+    return {
+        (test_case["test_case_id"], test_case["group"]): {"prompt": cache[key]["prompt"], "tokens": cache[key]["tokens"]}
+        for key, test_case in zip(keys, test_cases)
+    }
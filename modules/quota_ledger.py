@@ -0,0 +1,136 @@
+import datetime
+import hashlib
+import sqlite3
+import threading
+import time
+
+# Rolling windows tracked by the ledger (in seconds)
+MINUTE_WINDOW = 60
+DAY_WINDOW = 24 * 3600
+
+
+# Function to identify an API key without storing the key itself
+def key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+# ----------------------
+# PERSISTENT QUOTA LEDGER
+# ----------------------
+# Durable record of the requests and tokens spent per API key and model, kept
+# in a SQLite file so the rolling minute and day windows survive restarts. After
+# a crash the scheduler therefore knows exactly how much of each key's budget is
+# left, instead of starting from zero and running into 429s.
+class QuotaLedger:
+    def __init__(self, db_path):
+        self._connection = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS usage (
+                event_id TEXT PRIMARY KEY,
+                key_id TEXT NOT NULL,
+                model TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                requests INTEGER NOT NULL,
+                tokens INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_usage_key ON usage (key_id, model, timestamp);
+        """)
+
+    # Records the usage of a request. Events with an `event_id` already in the
+    # ledger are ignored, so seeding the same results twice is harmless.
+    def record(self, key_id, model, tokens, requests=1, timestamp=None, event_id=None):
+        timestamp = timestamp if timestamp is not None else time.time()
+        event_id = event_id or f"{key_id}:{timestamp}:{threading.get_ident()}"
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO usage VALUES (?, ?, ?, ?, ?, ?)",
+                (event_id, key_id, model, timestamp, requests, tokens),
+            )
+
+    # Returns the requests and tokens spent within the last `window` seconds
+    def usage(self, key_id, model, window, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            requests, tokens = self._connection.execute(
+                """
+                SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(tokens), 0) FROM usage
+                WHERE key_id = ? AND model = ? AND timestamp > ?
+                """,
+                (key_id, model, now - window),
+            ).fetchone()
+        return requests, tokens
+
+    # Returns 0 when the key can take another request within the limits,
+    # otherwise the number of seconds until enough usage leaves the windows.
+    # `limits` maps each window to its `(max_requests, max_tokens)`.
+    def wait_time(self, key_id, model, limits, now=None):
+        now = now if now is not None else time.time()
+        longest_wait = 0.0
+
+        for window, (max_requests, max_tokens) in limits.items():
+            requests, tokens = self.usage(key_id, model, window, now)
+            if requests < max_requests and tokens < max_tokens:
+                continue
+
+            # Walk the events of the window from the oldest one until the usage
+            # that expires by then brings the key back under both limits
+            with self._lock:
+                events = self._connection.execute(
+                    """
+                    SELECT timestamp, requests, tokens FROM usage
+                    WHERE key_id = ? AND model = ? AND timestamp > ?
+                    ORDER BY timestamp
+                    """,
+                    (key_id, model, now - window),
+                ).fetchall()
+
+            for timestamp, event_requests, event_tokens in events:
+                requests -= event_requests
+                tokens -= event_tokens
+                if requests < max_requests and tokens < max_tokens:
+                    longest_wait = max(longest_wait, timestamp + window - now)
+                    break
+
+        return longest_wait
+
+    # Drops events older than the longest window
+    def prune(self, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._connection.execute("DELETE FROM usage WHERE timestamp < ?", (now - DAY_WINDOW,))
+
+    # Seeds the ledger from stored evaluation results, using the key fingerprint,
+    # end time and `usage_metadata` of each result. Results without an
+    # `api_key_id` (written before the ledger existed) cannot be attributed to
+    # a key and are skipped, as are the copies of a result fanned out to
+    # duplicate test cases, which made no request of their own.
+    # Returns the number of results taken into account.
+    def seed_from_results(self, results, model):
+        cutoff = time.time() - DAY_WINDOW
+        seeded = 0
+
+        for result in results:
+            key_id = result.get("api_key_id")
+            if not key_id or "usage_metadata" not in result or "deduplicated_from" in result:
+                continue
+
+            end_time = datetime.datetime.strptime(result["time_taken"]["end_time"], "%d/%m/%Y %H:%M:%S")
+            timestamp = end_time.timestamp()
+            if timestamp < cutoff:
+                continue
+
+            self.record(
+                key_id,
+                model,
+                result["usage_metadata"].get("total_tokens", 0),
+                timestamp=timestamp,
+                event_id=f"{result['test_case_id']}:{result['group']}:{result['time_taken']['end_time']}",
+            )
+            seeded += 1
+
+        return seeded
+
+    def close(self):
+        self._connection.close()
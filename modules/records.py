@@ -0,0 +1,134 @@
+import sys
+from array import array
+
+from modules.consistency import CRITERIA
+
+# Metadata fields of a result kept when it is persisted; `response_metadata`
+# (model fingerprint, timings, finish reason...) is never read back, so only
+# the token usage and timing are kept
+USAGE_FIELDS = ("input_tokens", "output_tokens", "total_tokens")
+
+# Result fields stored as-is in the `extra` dict of a record when present
+EXTRA_FIELDS = (
+    "output_mode",
+    "consistency",
+    "api_key_id",
+    "deduplicated_from",
+    "served_by",
+    "terminated_early",
+)
+
+
+# ---------------------------
+# 1. COMPACT SUCCESS RECORD
+# ---------------------------
+# Compact in-memory form of an evaluation result. Scores live in a small byte
+# array, group and model names are interned so all records share one string,
+# and only the metadata we actually use is kept. `to_dict` gives back the
+# persisted JSON structure read by `calc_stats.py` and the resume filter.
+class EvaluationRecord:
+    __slots__ = (
+        "test_case_id",
+        "group",
+        "evaluated_by",
+        "scores",
+        "reasons",
+        "justification",
+        "start_time",
+        "end_time",
+        "duration",
+        "usage",
+        "extra",
+    )
+
+    def __init__(self, result):
+        evaluation = result["evaluation"]
+        time_taken = result["time_taken"]
+        usage_metadata = result.get("usage_metadata") or {}
+
+        self.test_case_id = result["test_case_id"]
+        self.group = sys.intern(result["group"])
+        self.evaluated_by = sys.intern(result["evaluated_by"])
+        self.scores = array("b", (evaluation[criterion]["score"] for criterion in CRITERIA))
+        self.reasons = tuple(evaluation[criterion]["reason"] for criterion in CRITERIA)
+        self.justification = evaluation["justification"]
+        self.start_time = time_taken["start_time"]
+        self.end_time = time_taken["end_time"]
+        self.duration = time_taken["duration_in_sec"]
+        self.usage = array("l", (usage_metadata.get(field, 0) for field in USAGE_FIELDS))
+
+        extra = {field: result[field] for field in EXTRA_FIELDS if field in result}
+        self.extra = extra or None
+
+    def to_dict(self):
+        evaluation = {
+            criterion: {"score": score, "reason": reason}
+            for criterion, score, reason in zip(CRITERIA, self.scores, self.reasons)
+        }
+        evaluation["justification"] = self.justification
+
+        result = {
+            "test_case_id": self.test_case_id,
+            "evaluation": evaluation,
+            "evaluated_by": self.evaluated_by,
+            "time_taken": {
+                "start_time": self.start_time,
+                "end_time": self.end_time,
+                "duration_in_sec": self.duration,
+            },
+            "group": self.group,
+            "usage_metadata": dict(zip(USAGE_FIELDS, self.usage)),
+        }
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+
+# ---------------------------
+# 2. COMPACT FAILURE RECORD
+# ---------------------------
+# Compact form of a failed evaluation. The test case is referenced by its
+# (test_case_id, group) instead of keeping a full copy of it, and the raw LLM
+# output is reduced to its text content.
+class FailureRecord:
+    __slots__ = (
+        "test_case_id",
+        "group",
+        "evaluated_by",
+        "llm_raw_output",
+        "error",
+        "output_mode",
+        "start_time",
+        "end_time",
+        "duration",
+    )
+
+    def __init__(self, failed_case):
+        test_case = failed_case["test_case"]
+        llm_raw_output = failed_case["llm_raw_output"]
+        time_taken = failed_case["time_taken"]
+
+        self.test_case_id = test_case["test_case_id"]
+        self.group = sys.intern(test_case["group"])
+        self.evaluated_by = sys.intern(failed_case["evaluated_by"])
+        self.llm_raw_output = getattr(llm_raw_output, "content", llm_raw_output)
+        self.error = failed_case["error_exception_details"]
+        self.output_mode = sys.intern(failed_case.get("output_mode", "prose"))
+        self.start_time = time_taken["start_time"]
+        self.end_time = time_taken["end_time"]
+        self.duration = time_taken["duration_in_sec"]
+
+    def to_dict(self):
+        return {
+            "evaluated_by": self.evaluated_by,
+            "test_case_id": self.test_case_id,
+            "group": self.group,
+            "llm_raw_output": self.llm_raw_output,
+            "error_exception_details": self.error,
+            "output_mode": self.output_mode,
+            "time_taken": {
+                "start_time": self.start_time,
+                "end_time": self.end_time,
+                "duration_in_sec": self.duration,
+            },
+        }
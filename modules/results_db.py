@@ -0,0 +1,347 @@
+import datetime
+import os
+import sqlite3
+import threading
+
+from modules.consistency import CRITERIA
+from modules.helper import iter_data
+from modules.stats_helper import format_data_to_evaluations
+
+# Score columns that can be filtered and aggregated on
+METRICS = CRITERIA + ["quality_score"]
+
+# Descriptive fields of the test cases stored alongside the evaluations
+TEST_CASE_FIELDS = ["software_name", "test_module", "test_feature", "severity_status"]
+
+# Version of the tables below; the database only caches the JSON files, so an
+# older database is rebuilt from them rather than migrated
+SCHEMA_VERSION = 2
+
+# Kinds of synced files
+RESULTS = "results"
+TEST_CASES = "test_cases"
+
+
+# Function to turn a "%d/%m/%Y %H:%M:%S" time into a sortable ISO time
+def _iso_time(value):
+    return datetime.datetime.strptime(value, "%d/%m/%Y %H:%M:%S").isoformat(sep=" ") if value else None
+
+
+# ---------------------------
+# INDEXED RESULTS DATABASE
+# ---------------------------
+# SQLite store of the evaluation results (scores, reasons, model, timing and
+# token usage) joined with the descriptive fields of the test cases, so ad-hoc
+# questions and per-group aggregates are answered with indexed SQL queries
+# instead of loading and scanning the JSON result files.
+#
+# It is populated incrementally: `sync_results` and `sync_test_cases` remember
+# the size and modification time of every file they read and skip the files
+# that did not change since. Every row records the file it came from, and a
+# changed file replaces all of its rows, so results removed from a file leave
+# the database and repeated results are kept as often as the file has them.
+# Lookups use a (test_case_id, group) index and every metric has a
+# (group, score) index for the filters.
+class ResultsDB:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._connection = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._create_tables()
+
+    def _create_tables(self):
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._connection.executescript("""
+                DROP TABLE IF EXISTS evaluations;
+                DROP TABLE IF EXISTS test_cases;
+                DROP TABLE IF EXISTS sources;
+            """)
+
+        score_columns = "\n".join(f"{metric} INTEGER NOT NULL," for metric in CRITERIA)
+        reason_columns = "\n".join(f"{metric}_reason TEXT," for metric in CRITERIA)
+        metric_indexes = "\n".join(
+            f"CREATE INDEX IF NOT EXISTS idx_evaluations_{metric} ON evaluations (group_name, {metric});"
+            for metric in METRICS
+        )
+        test_case_columns = "\n".join(f"{field} TEXT," for field in TEST_CASE_FIELDS)
+
+        self._connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS evaluations (
+                test_case_id TEXT NOT NULL,
+                group_name TEXT NOT NULL,
+                model TEXT NOT NULL,
+                {score_columns}
+                quality_score REAL NOT NULL,
+                {reason_columns}
+                justification TEXT,
+                start_time TEXT,
+                end_time TEXT,
+                duration_in_sec REAL,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                total_tokens INTEGER,
+                api_key_id TEXT,
+                deduplicated INTEGER NOT NULL DEFAULT 0,
+                source TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_evaluations_case ON evaluations (test_case_id, group_name);
+            CREATE INDEX IF NOT EXISTS idx_evaluations_source ON evaluations (source);
+            CREATE INDEX IF NOT EXISTS idx_evaluations_end_time ON evaluations (end_time);
+            {metric_indexes}
+            CREATE TABLE IF NOT EXISTS test_cases (
+                test_case_id TEXT NOT NULL,
+                group_name TEXT NOT NULL,
+                {test_case_columns}
+                source TEXT NOT NULL,
+                PRIMARY KEY (test_case_id, group_name)
+            );
+            CREATE INDEX IF NOT EXISTS idx_test_cases_software ON test_cases (software_name, group_name);
+            CREATE INDEX IF NOT EXISTS idx_test_cases_source ON test_cases (source);
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                records INTEGER NOT NULL
+            );
+            PRAGMA user_version = {SCHEMA_VERSION};
+        """)
+
+    # Runs `operation(cursor)` inside a write transaction
+    def _transaction(self, operation):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(cursor)
+                cursor.execute("COMMIT")
+                return result
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    # Whether a file changed since it was last synced; returns its (size, mtime)
+    # when it did, None otherwise
+    def _changed(self, file_path):
+        stat = os.stat(file_path)
+        row = self._query("SELECT size, mtime FROM sources WHERE path = ?", (os.path.abspath(file_path),))
+        if row and row[0]["size"] == stat.st_size and row[0]["mtime"] == stat.st_mtime:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    # Removes the rows of a synced file and its source entry
+    def _remove_source(self, cursor, path):
+        cursor.execute("DELETE FROM evaluations WHERE source = ?", (path,))
+        cursor.execute("DELETE FROM test_cases WHERE source = ?", (path,))
+        cursor.execute("DELETE FROM sources WHERE path = ?", (path,))
+
+    def _record_source(self, cursor, path, kind, size, mtime, records):
+        cursor.execute("INSERT INTO sources VALUES (?, ?, ?, ?, ?)", (path, kind, size, mtime, records))
+
+    # Loads the evaluation results of a file (JSON or JSON Lines, see
+    # `load_data`) unless it is unchanged since the last sync; the rows of an
+    # earlier sync of the file are replaced. With `exclusive` the results of
+    # every other file are removed, so the database mirrors this file only
+    # (i.e. when the archive moved from JSON to compressed JSON Lines).
+    # Returns the number of results read, 0 when the file was skipped.
+    def sync_results(self, file_path, exclusive=False, chunk_size=5000):
+        path = os.path.abspath(file_path)
+        changed = self._changed(file_path) if os.path.getsize(file_path) > 0 else None
+        stale = [
+            row["path"]
+            for row in self._query("SELECT path FROM sources WHERE kind = ? AND path != ?", (RESULTS, path))
+        ] if exclusive else []
+
+        if changed is None and not stale:
+            return 0
+
+        def insert(cursor):
+            for stale_path in stale:
+                self._remove_source(cursor, stale_path)
+            if changed is None:
+                return 0
+
+            self._remove_source(cursor, path)
+            count = 0
+            chunk = []
+            for result in iter_data(file_path):
+                chunk.append(result)
+                if len(chunk) >= chunk_size:
+                    count += self._insert_results(cursor, chunk, path)
+                    chunk = []
+            count += self._insert_results(cursor, chunk, path)
+            self._record_source(cursor, path, RESULTS, *changed, count)
+            return count
+
+        return self._transaction(insert)
+
+    def _insert_results(self, cursor, results, source):
+        rows = []
+        for result, evaluation in zip(results, format_data_to_evaluations(results)):
+            time_taken = result.get("time_taken") or {}
+            usage_metadata = result.get("usage_metadata") or {}
+            rows.append((
+                result["test_case_id"],
+                result["group"],
+                result.get("evaluated_by", ""),
+                *(evaluation[metric] for metric in METRICS),
+                *(result["evaluation"][metric].get("reason") for metric in CRITERIA),
+                result["evaluation"].get("justification"),
+                _iso_time(time_taken.get("start_time")),
+                _iso_time(time_taken.get("end_time")),
+                time_taken.get("duration_in_sec"),
+                usage_metadata.get("input_tokens"),
+                usage_metadata.get("output_tokens"),
+                usage_metadata.get("total_tokens"),
+                result.get("api_key_id"),
+                int("deduplicated_from" in result),
+                source,
+            ))
+
+        if rows:
+            placeholders = ", ".join("?" * len(rows[0]))
+            cursor.executemany(f"INSERT INTO evaluations VALUES ({placeholders})", rows)
+        return len(rows)
+
+    # Loads the descriptive fields of the test cases (i.e. `cleaned_data.json`)
+    # unless the file is unchanged since the last sync
+    def sync_test_cases(self, file_path):
+        path = os.path.abspath(file_path)
+        changed = self._changed(file_path)
+        if changed is None:
+            return 0
+
+        def insert(cursor):
+            self._remove_source(cursor, path)
+            rows = [
+                (case["test_case_id"], case["group"], *(case.get(field) for field in TEST_CASE_FIELDS), path)
+                for case in iter_data(file_path)
+            ]
+            placeholders = ", ".join("?" * (3 + len(TEST_CASE_FIELDS)))
+            cursor.executemany(f"INSERT OR REPLACE INTO test_cases VALUES ({placeholders})", rows)
+            self._record_source(cursor, path, TEST_CASES, *changed, len(rows))
+            return len(rows)
+
+        return self._transaction(insert)
+
+    # Builds the WHERE clause of the query filters; metric names are checked
+    # against METRICS since they are placed in the SQL text
+    def _where(self, model=None, group=None, software_name=None, min_scores=None, max_scores=None):
+        clauses, parameters = [], []
+        if model is not None:
+            clauses.append("e.model = ?")
+            parameters.append(model)
+        if group is not None:
+            clauses.append("e.group_name = ?")
+            parameters.append(group)
+        if software_name is not None:
+            clauses.append("t.software_name = ?")
+            parameters.append(software_name)
+
+        for operator, scores in ((">=", min_scores), ("<=", max_scores)):
+            for metric, value in (scores or {}).items():
+                if metric not in METRICS:
+                    raise ValueError(f"Unknown metric: {metric}")
+                clauses.append(f"e.{metric} {operator} ?")
+                parameters.append(value)
+
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", parameters
+
+    # Returns the evaluations matching the filters as dicts, i.e. the cases of
+    # a group with a clarity of 2 or less for a software:
+    #   find(group="human-engineers", software_name="ShopEase", max_scores={"clarity": 2})
+    def find(self, model=None, group=None, software_name=None, min_scores=None, max_scores=None):
+        where, parameters = self._where(model, group, software_name, min_scores, max_scores)
+        rows = self._query(
+            f"""
+            SELECT e.*, {", ".join(f"t.{field}" for field in TEST_CASE_FIELDS)}
+            FROM evaluations e LEFT JOIN test_cases t
+            ON t.test_case_id = e.test_case_id AND t.group_name = e.group_name
+            {where}
+            ORDER BY e.group_name, e.test_case_id
+            """,
+            parameters,
+        )
+        return [dict(row) for row in rows]
+
+    # Returns the scores in the format of `format_data_to_evaluations`, ready
+    # for the functions of `stats_helper`
+    def evaluations(self, model=None):
+        where, parameters = self._where(model)
+        rows = self._query(
+            f"SELECT e.test_case_id, e.group_name AS \"group\", {', '.join(f'e.{metric}' for metric in METRICS)} "
+            f"FROM evaluations e{where}",
+            parameters,
+        )
+        return [dict(row) for row in rows]
+
+    # Returns the (test_case_id, group) of every evaluated test case; accepted
+    # by `filter_unprocessed_test_cases` in place of the list of results
+    def processed_keys(self, model=None):
+        where, parameters = self._where(model)
+        return {tuple(row) for row in self._query(f"SELECT e.test_case_id, e.group_name FROM evaluations e{where}", parameters)}
+
+    # Returns the input, output and total tokens used by the evaluations;
+    # copies of a result fanned out to duplicate test cases are not counted
+    # since they made no request of their own
+    def token_usage(self, model=None):
+        where, parameters = self._where(model)
+        where += (" AND " if where else " WHERE ") + "e.deduplicated = 0"
+        row = self._query(
+            "SELECT COALESCE(SUM(e.input_tokens), 0), COALESCE(SUM(e.output_tokens), 0), "
+            f"COALESCE(SUM(e.total_tokens), 0) FROM evaluations e{where}",
+            parameters,
+        )[0]
+        return {"input_tokens": row[0], "output_tokens": row[1], "total_tokens": row[2]}
+
+    # Returns the evaluations made with a known API key since `since` (a
+    # datetime), shaped like results for `QuotaLedger.seed_from_results`
+    def recent_usage(self, since, model=None):
+        where, parameters = self._where(model)
+        where += (" AND " if where else " WHERE ") + "e.api_key_id IS NOT NULL AND e.deduplicated = 0 AND e.end_time >= ?"
+        rows = self._query(
+            f"SELECT e.test_case_id, e.group_name, e.api_key_id, e.total_tokens, e.end_time FROM evaluations e{where}",
+            (*parameters, since.isoformat(sep=" ")),
+        )
+        return [
+            {
+                "test_case_id": row["test_case_id"],
+                "group": row["group_name"],
+                "api_key_id": row["api_key_id"],
+                "usage_metadata": {"total_tokens": row["total_tokens"] or 0},
+                "time_taken": {
+                    "end_time": datetime.datetime.fromisoformat(row["end_time"]).strftime("%d/%m/%Y %H:%M:%S")
+                },
+            }
+            for row in rows
+        ]
+
+    # Returns the number of cases and the average of every metric per group
+    def group_aggregates(self, model=None, software_name=None):
+        where, parameters = self._where(model, software_name=software_name)
+        # The test cases are only joined when filtering on their fields
+        join = (
+            "JOIN test_cases t ON t.test_case_id = e.test_case_id AND t.group_name = e.group_name"
+            if software_name is not None
+            else ""
+        )
+        rows = self._query(
+            f"""
+            SELECT e.group_name AS "group", COUNT(*) AS cases,
+                   {", ".join(f"AVG(e.{metric}) AS avg_{metric}" for metric in METRICS)}
+            FROM evaluations e {join}
+            {where}
+            GROUP BY e.group_name
+            ORDER BY e.group_name
+            """,
+            parameters,
+        )
+        return {row["group"]: dict(row) for row in rows}
+
+    def close(self):
+        self._connection.close()
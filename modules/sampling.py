@@ -0,0 +1,157 @@
+import math
+import random
+from statistics import NormalDist, mean, stdev
+
+from modules.stats_helper import format_data_to_evaluations
+
+
+# ---------------------------------
+# ADAPTIVE STRATIFIED SAMPLING PLAN
+# ---------------------------------
+# Estimates the mean `quality_score` of every group to a target precision by
+# evaluating a sample of the test cases instead of all of them. Test cases are
+# drawn in rounds, stratified by `group` and, within a group, proportionally to
+# its `software_name`s. After each round the next round's budget goes to the
+# groups whose confidence interval is still wider than `target_half_width`, in
+# proportion to the number of samples they still need; a group stops being
+# sampled once its interval is narrow enough (or it has no cases left).
+class StratifiedSampler:
+    def __init__(
+        self,
+        test_cases,
+        target_half_width=0.1,
+        confidence=0.95,
+        min_per_group=10,
+        round_size=60,
+        seed=0,
+    ):
+        self.target_half_width = target_half_width
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.min_per_group = min_per_group
+        self.round_size = round_size
+        self.rounds = 0
+        self._rng = random.Random(seed)
+
+        # group -> software_name -> test cases not drawn yet (in random order)
+        self._strata = {}
+        for test_case in test_cases:
+            group_strata = self._strata.setdefault(test_case["group"], {})
+            group_strata.setdefault(test_case["software_name"], []).append(test_case)
+        for group_strata in self._strata.values():
+            for stratum in group_strata.values():
+                self._rng.shuffle(stratum)
+
+        self.population = {
+            group: sum(len(stratum) for stratum in group_strata.values())
+            for group, group_strata in self._strata.items()
+        }
+        self._drawn = {group: {} for group in self._strata}
+        self._scores = {group: [] for group in self._strata}
+        self._seen = set()
+
+    # Number of cases still available in a group
+    def _available(self, group):
+        return sum(len(stratum) for stratum in self._strata[group].values())
+
+    # Half-width of the confidence interval of a group's mean quality score,
+    # with the finite population correction (it reaches 0 once every case of
+    # the group is scored); infinite with fewer than two scores
+    def half_width(self, group):
+        scores = self._scores[group]
+        n, population = len(scores), self.population[group]
+        if n < 2:
+            return math.inf
+        correction = math.sqrt((population - n) / (population - 1)) if population > 1 else 0.0
+        return self.z * stdev(scores) / math.sqrt(n) * correction
+
+    # Whether a group no longer needs samples
+    def is_settled(self, group):
+        if self._available(group) == 0:
+            return True
+        return len(self._scores[group]) >= self.min_per_group and self.half_width(group) <= self.target_half_width
+
+    def done(self):
+        return all(self.is_settled(group) for group in self._strata)
+
+    # Estimated number of additional scores a group needs to reach the target
+    def _needed(self, group):
+        scores = self._scores[group]
+        if len(scores) < 2:
+            return max(self.min_per_group - len(scores), 1)
+        # n = (z * s / e)^2, assuming the spread observed so far holds
+        required = (self.z * stdev(scores) / self.target_half_width) ** 2
+        return max(math.ceil(required) - len(scores), self.min_per_group - len(scores), 1)
+
+    # Draws `count` cases from a group, taking each one from the software stratum
+    # furthest below its proportional share of the group's sample
+    def _draw(self, group, count):
+        group_strata = self._strata[group]
+        drawn = self._drawn[group]
+        sample = []
+
+        for _ in range(count):
+            candidates = [name for name, stratum in group_strata.items() if stratum]
+            if not candidates:
+                break
+            total_drawn = sum(drawn.values()) + 1
+            software_name = max(
+                candidates,
+                key=lambda name: (len(group_strata[name]) + drawn.get(name, 0)) / self.population[group]
+                - drawn.get(name, 0) / total_drawn,
+            )
+            sample.append(group_strata[software_name].pop())
+            drawn[software_name] = drawn.get(software_name, 0) + 1
+
+        return sample
+
+    # Returns the test cases to evaluate in the next round, empty once done
+    def next_round(self):
+        open_groups = [group for group in self._strata if not self.is_settled(group)]
+        if not open_groups:
+            return []
+
+        self.rounds += 1
+        needed = {group: min(self._needed(group), self._available(group)) for group in open_groups}
+        total_needed = sum(needed.values())
+
+        # Split the round's budget in proportion to the remaining need, never
+        # giving a group more than it needs and at least one sample
+        budget = max(self.round_size, len(open_groups))
+        sample = []
+        for group in open_groups:
+            share = max(1, round(budget * needed[group] / total_needed))
+            sample.extend(self._draw(group, min(share, needed[group])))
+        return sample
+
+    # Takes the evaluation results into account; test cases that were evaluated
+    # earlier (i.e. in a previous run) are removed from the strata as well
+    def add_results(self, results):
+        for result, evaluation in zip(results, format_data_to_evaluations(results)):
+            key = (result["test_case_id"], result["group"])
+            if key in self._seen or result["group"] not in self._strata:
+                continue
+            self._seen.add(key)
+            self._scores[result["group"]].append(evaluation["quality_score"])
+
+            # Remove the case from its stratum if it was not drawn by this sampler
+            drawn = self._drawn[result["group"]]
+            for software_name, stratum in self._strata[result["group"]].items():
+                for index, test_case in enumerate(stratum):
+                    if test_case["test_case_id"] == result["test_case_id"]:
+                        del stratum[index]
+                        drawn[software_name] = drawn.get(software_name, 0) + 1
+                        break
+
+    # Precision reached per group, suitable for a stats file
+    def precision(self):
+        report = {}
+        for group, scores in self._scores.items():
+            half_width = self.half_width(group)
+            report[group] = {
+                "population": self.population[group],
+                "sampled": len(scores),
+                "mean_quality_score": mean(scores) if scores else None,
+                "ci_half_width": None if math.isinf(half_width) else half_width,
+                "target_met": half_width <= self.target_half_width,
+            }
+        return report
@@ -0,0 +1,260 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from modules.helper import CustomEncoder
+
+# Status of the items in the work queue
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+# ---------------------------
+# LEASE BASED WORK QUEUE
+# ---------------------------
+# Work queue of (test_case_id, group) items backed by a SQLite file, so that
+# several workers on different machines can share it over a network filesystem.
+# Workers lease batches of items for `lease_timeout` seconds; items whose lease
+# expired (i.e. the worker crashed) are issued again to the next worker. A result
+# is only accepted while the worker still holds the lease, so every item is
+# accounted for exactly once even when a slow worker loses its lease. An item
+# whose lease expired `max_attempts` times (i.e. it crashes every worker) is
+# marked as failed instead of being issued again.
+#
+# WAL journaling is deliberately not enabled since it does not work on network
+# filesystems; the default rollback journal with `BEGIN IMMEDIATE` is used.
+class LeaseQueue:
+    def __init__(self, db_path, lease_timeout=600, max_attempts=3):
+        self.db_path = db_path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._connection = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._create_tables()
+
+    def _create_tables(self):
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS work_items (
+                test_case_id TEXT NOT NULL,
+                group_name TEXT NOT NULL,
+                test_case TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                lease_token TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                duplicates TEXT NOT NULL DEFAULT '[]',
+                PRIMARY KEY (test_case_id, group_name)
+            );
+            CREATE INDEX IF NOT EXISTS idx_work_items_status ON work_items (status, lease_expires);
+            CREATE TABLE IF NOT EXISTS results (
+                test_case_id TEXT NOT NULL,
+                group_name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                record TEXT NOT NULL,
+                worker_id TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (test_case_id, group_name)
+            );
+        """)
+
+    # Runs `operation(cursor)` inside a write transaction
+    # (the connection is shared by the threads of a worker, hence the lock)
+    def _transaction(self, operation):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(cursor)
+                cursor.execute("COMMIT")
+                return result
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    # Adds test cases to the queue, items already queued are left untouched.
+    # `duplicates` maps the (test_case_id, group) of a test case to the
+    # duplicates sharing its result (see deduplicate_test_cases); they are
+    # stored with the item so the result is fanned out to the same test cases
+    # that were deduplicated when it was queued.
+    # Returns the number of newly queued items.
+    def enqueue(self, test_cases, duplicates=None):
+        duplicates = duplicates or {}
+        rows = [
+            (
+                case["test_case_id"],
+                case["group"],
+                json.dumps(case),
+                json.dumps(duplicates.get((case["test_case_id"], case["group"]), [])),
+            )
+            for case in test_cases
+        ]
+
+        def operation(cursor):
+            before = cursor.execute("SELECT COUNT(*) FROM work_items").fetchone()[0]
+            cursor.executemany(
+                """
+                INSERT OR IGNORE INTO work_items (test_case_id, group_name, test_case, duplicates)
+                VALUES (?, ?, ?, ?)
+                """,
+                rows,
+            )
+            return cursor.execute("SELECT COUNT(*) FROM work_items").fetchone()[0] - before
+
+        return self._transaction(operation)
+
+    # Leases up to `batch_size` pending or expired items to the worker.
+    # Expired items that used up their attempts are marked as failed first.
+    # Returns the lease token and the leased test cases.
+    def lease(self, worker_id, batch_size):
+        lease_token = uuid.uuid4().hex
+
+        def operation(cursor):
+            now = time.time()
+            self._fail_exhausted(cursor, now)
+            rows = cursor.execute(
+                """
+                SELECT test_case_id, group_name, test_case FROM work_items
+                WHERE status = ? OR (status = ? AND lease_expires < ?)
+                LIMIT ?
+                """,
+                (PENDING, LEASED, now, batch_size),
+            ).fetchall()
+
+            cursor.executemany(
+                """
+                UPDATE work_items
+                SET status = ?, worker_id = ?, lease_token = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE test_case_id = ? AND group_name = ?
+                """,
+                [
+                    (LEASED, worker_id, lease_token, now + self.lease_timeout, test_case_id, group_name)
+                    for test_case_id, group_name, _ in rows
+                ],
+            )
+            return [json.loads(test_case) for _, _, test_case in rows]
+
+        return lease_token, self._transaction(operation)
+
+    # Marks the items whose lease expired on each of their `max_attempts`
+    # attempts as failed, storing a failure record for them
+    def _fail_exhausted(self, cursor, now):
+        rows = cursor.execute(
+            """
+            SELECT test_case_id, group_name, test_case, worker_id, attempts FROM work_items
+            WHERE status = ? AND lease_expires < ? AND attempts >= ?
+            """,
+            (LEASED, now, self.max_attempts),
+        ).fetchall()
+
+        cursor.executemany(
+            """
+            UPDATE work_items SET status = ?, lease_token = NULL, lease_expires = NULL
+            WHERE test_case_id = ? AND group_name = ?
+            """,
+            [(FAILED, test_case_id, group_name) for test_case_id, group_name, *_ in rows],
+        )
+        cursor.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    test_case_id,
+                    group_name,
+                    FAILED,
+                    json.dumps({
+                        "test_case": json.loads(test_case),
+                        "llm_raw_output": "",
+                        "error_exception_details": f"Lease expired on all {attempts} attempts, the worker never completed it",
+                        "error_status_code": None,
+                    }),
+                    worker_id,
+                    now,
+                )
+                for test_case_id, group_name, test_case, worker_id, attempts in rows
+            ],
+        )
+
+    # Extends a lease while its batch is still being processed
+    def renew(self, lease_token):
+        def operation(cursor):
+            cursor.execute(
+                "UPDATE work_items SET lease_expires = ? WHERE lease_token = ? AND status = ?",
+                (time.time() + self.lease_timeout, lease_token, LEASED),
+            )
+            return cursor.rowcount
+
+        return self._transaction(operation)
+
+    # Stores the result of a leased item and marks it as done or failed.
+    # Returns False when the lease was lost, in which case the result is dropped.
+    def complete(self, test_case, lease_token, worker_id, record, failed=False):
+        key = (test_case["test_case_id"], test_case["group"])
+        status = FAILED if failed else DONE
+
+        def operation(cursor):
+            cursor.execute(
+                """
+                UPDATE work_items SET status = ?, lease_expires = NULL
+                WHERE test_case_id = ? AND group_name = ? AND status = ? AND lease_token = ?
+                """,
+                (status, *key, LEASED, lease_token),
+            )
+            if cursor.rowcount == 0:
+                return False
+
+            cursor.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, status, json.dumps(record, cls=CustomEncoder), worker_id, time.time()),
+            )
+            return True
+
+        return self._transaction(operation)
+
+    # Puts a leased item back in the queue (i.e. after a rate limit error),
+    # the attempt is not counted since the worker did not crash on it
+    def release(self, test_case, lease_token):
+        def operation(cursor):
+            cursor.execute(
+                """
+                UPDATE work_items SET status = ?, lease_token = NULL, lease_expires = NULL, attempts = attempts - 1
+                WHERE test_case_id = ? AND group_name = ? AND status = ? AND lease_token = ?
+                """,
+                (PENDING, test_case["test_case_id"], test_case["group"], LEASED, lease_token),
+            )
+
+        self._transaction(operation)
+
+    # Number of items per status
+    def stats(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*) FROM work_items GROUP BY status"
+            ).fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    # Returns the stored successful and failed records
+    def export_results(self):
+        success_cases, failed_cases = [], []
+        with self._lock:
+            rows = self._connection.execute("SELECT status, record FROM results").fetchall()
+        for status, record in rows:
+            (success_cases if status == DONE else failed_cases).append(json.loads(record))
+        return success_cases, failed_cases
+
+    # Returns the duplicates stored with each queued item, keyed by its
+    # (test_case_id, group)
+    def duplicates(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT test_case_id, group_name, duplicates FROM work_items"
+            ).fetchall()
+        return {(test_case_id, group_name): json.loads(cases) for test_case_id, group_name, cases in rows}
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,165 @@
+import os
+from tqdm import tqdm
+
+from modules.helper import load_data, save_data, filter_unprocessed_test_cases, find_data_file, get_model_dir
+from modules.langchain_helper import get_stream_client
+from modules.concurrency import OK, RATE_LIMITED
+from modules.evaluator import evaluate_with_ollama, evaluate_with_groq
+from modules.quota_ledger import QuotaLedger
+from modules.key_health import NoHealthyKeysError, KEY_ERROR
+from modules.key_pool import ApiKeyPool
+from modules.dedup import deduplicate_test_cases, fan_out_result, report_deduplication
+from modules.backend_router import Backend, BackendRouter
+from groq_main import QUOTA_LIMITS
+
+# Evaluates the test cases on several backends at the same time (i.e. local
+# Ollama GPUs and the Groq API). Work goes to whichever backend has capacity,
+# weighted by the capacity weights below and the observed latency/error rate.
+
+# Backends to route the work to. Groq backends are only used when API keys
+# are configured in `modules/api_keys.py`.
+OLLAMA_BACKENDS = [
+    {"model": "llama3.2:3b", "base_url": "http://localhost:11434", "weight": 1.0},
+]
+GROQ_BACKENDS = [
+    {"model": "mixtral-8x7b-32768", "weight": 2.0},
+]
+
+STRUCTURED_OUTPUT = False
+THINK_TOKEN_BUDGET = 512
+RESULTS_DIR = "data/evaluations/router"
+
+try:
+    from modules.api_keys import api_keys
+except ImportError:
+    api_keys = []
+
+
+# Load all test cases and remove the ones already processed
+all_test_cases = load_data("data/cleaned_data.json")
+processed_path = find_data_file(f"{RESULTS_DIR}/archive/processed_results.json")
+processed_test_cases = load_data(processed_path) if os.path.exists(processed_path) else []
+test_cases = filter_unprocessed_test_cases(all_test_cases, processed_test_cases)
+
+# Evaluate each unique prompt payload only once
+unique_test_cases, duplicate_cases = deduplicate_test_cases(test_cases)
+report_deduplication(test_cases, unique_test_cases)
+
+# Lists to hold successful, unsuccessful and remaining test cases
+success_jobs = []
+failed_jobs = []
+remaining_jobs = []
+
+
+# Function to build a backend serving an Ollama model on a given host
+def make_ollama_backend(config):
+    client = get_stream_client(model_name=config["model"], base_url=config["base_url"])
+    name = f"ollama:{config['model']}@{config['base_url'].split('//')[-1]}"
+
+    def evaluate(test_case):
+        outcome, duration, record = evaluate_with_ollama(
+            test_case, client, structured=STRUCTURED_OUTPUT, think_budget=THINK_TOKEN_BUDGET
+        )
+        record["served_by"] = name
+        collect(test_case, outcome, record)
+        return outcome, duration
+
+    return Backend(name, evaluate, weight=config["weight"])
+
+
+# Function to build a backend serving a Groq model. The requests are spread
+# over the API keys within their quota, booked in the same ledger as
+# `groq_main.py`, and keys that fail (invalid, exhausted or rate limited) are set
+# aside while the other keys keep serving; the backend is disabled once every
+# key is invalid.
+def make_groq_backend(config):
+    name = f"groq:{config['model']}"
+    ledger_dir = get_model_dir(config["model"])
+    os.makedirs(ledger_dir, exist_ok=True)
+    key_pool = ApiKeyPool(api_keys, config["model"], QuotaLedger(f"{ledger_dir}/quota_ledger.sqlite"), QUOTA_LIMITS)
+
+    def evaluate(test_case):
+        try:
+            api_key = key_pool.select()
+        except NoHealthyKeysError:
+            backend.disabled = True
+            return KEY_ERROR, 0.0
+
+        outcome, duration, record = evaluate_with_groq(
+            test_case, config["model"], api_key, structured=STRUCTURED_OUTPUT
+        )
+        outcome = key_pool.record_result(api_key, outcome, record)
+        record["served_by"] = name
+        collect(test_case, outcome, record)
+        return outcome, duration
+
+    backend = Backend(name, evaluate, weight=config["weight"])
+    return backend
+
+
+# Function to store the record of an evaluated test case
+def collect(test_case, outcome, record):
+    if outcome == OK:
+        success_jobs.append(record)
+        success_jobs.extend(
+            fan_out_result(record, duplicate_cases[(test_case["test_case_id"], test_case["group"])])
+        )
+    elif outcome not in (RATE_LIMITED, KEY_ERROR):
+        # Rate limited cases and the ones failed by their API key are queued
+        # again instead of being marked as failed
+        failed_jobs.append(record)
+
+
+# ===========================================
+# MAIN EXECUTION
+# ===========================================
+backends = [make_ollama_backend(config) for config in OLLAMA_BACKENDS]
+if api_keys:
+    backends += [make_groq_backend(config) for config in GROQ_BACKENDS]
+
+router = BackendRouter(backends)
+os.makedirs(RESULTS_DIR, exist_ok=True)
+total_cases = len(unique_test_cases)
+
+if total_cases > 0:
+    progress = tqdm(
+        total=total_cases,
+        bar_format="[{elapsed}<{remaining}] {n_fmt}/{total_fmt} | {l_bar}{bar} {rate_fmt}{postfix}",
+        desc="Evaluating Test Cases",
+        colour="green",
+    )
+
+    def on_result(test_case, outcome, backend):
+        if outcome in (RATE_LIMITED, KEY_ERROR):
+            return True
+
+        progress.update(1)
+
+        # Save results after processing every 100 test case
+        if progress.n % 100 == 0:
+            save_data(success_jobs, f"{RESULTS_DIR}/success.json")
+            save_data(failed_jobs, f"{RESULTS_DIR}/failed.json")
+            save_data(remaining_jobs, f"{RESULTS_DIR}/remaining.json")
+        return False
+
+    # Keep track of the remaining cases and show the state of every backend
+    def on_tick(remaining):
+        global remaining_jobs
+
+        remaining_jobs = remaining
+        progress.set_postfix(router.state())
+
+    router.run(unique_test_cases, on_result, on_tick)
+    progress.close()
+
+    save_data(success_jobs, f"{RESULTS_DIR}/success.json")
+    save_data(failed_jobs, f"{RESULTS_DIR}/failed.json")
+    save_data(remaining_jobs, f"{RESULTS_DIR}/remaining.json")
+
+    print("\n------------")
+    print("Final Report")
+    print("------------")
+    print(f"- Success: {len(success_jobs)} / {len(test_cases)}")
+    print(f"- Failed: {len(failed_jobs)} / {total_cases}")
+    for backend in backends:
+        print(f"- {backend.name}: served {backend.served}, error rate {backend.error_rate:.2%}")
@@ -0,0 +1,140 @@
+import os
+from tqdm import tqdm
+
+from modules.helper import load_data, save_data, get_model_dir, find_data_file
+from modules.langchain_helper import get_stream_client
+from modules.concurrency import AIMDController, run_adaptive, OK
+from modules.evaluator import evaluate_with_ollama
+from modules.records import EvaluationRecord, FailureRecord
+from modules.sampling import StratifiedSampler
+from modules.stats_helper import get_descriptive_stats, structuring_stats_in_metrics, format_data_to_evaluations
+
+# Estimates the per-group quality scores to a target precision by evaluating
+# a stratified sample of the test cases, in rounds, instead of all of them.
+# After every round a partial `stats.json` is written along with the precision
+# reached per group, so exploratory comparisons can stop early.
+
+models_list = ["deepseek-r1:1.5b", "llama3.2:3b", "mistral:7b"]
+active_model = models_list[1]
+
+STRUCTURED_OUTPUT = False
+THINK_TOKEN_BUDGET = 512
+
+# Target half-width of the confidence interval of each group's mean quality
+# score (scores range from 1 to 5) and the confidence level
+TARGET_HALF_WIDTH = 0.1
+CONFIDENCE = 0.95
+MIN_PER_GROUP = 10
+ROUND_SIZE = 60
+
+evaluations_dir = f"{get_model_dir(active_model)}/sampling"
+results_dir = f"data/results/{active_model.replace(':', '-')}/sampling"
+os.makedirs(evaluations_dir, exist_ok=True)
+os.makedirs(results_dir, exist_ok=True)
+
+# Load test cases data
+all_test_cases = load_data("data/cleaned_data.json")
+sampler = StratifiedSampler(
+    all_test_cases,
+    target_half_width=TARGET_HALF_WIDTH,
+    confidence=CONFIDENCE,
+    min_per_group=MIN_PER_GROUP,
+    round_size=ROUND_SIZE,
+)
+
+# Results of a full evaluation and of a previous sampling run count towards the sample
+archived_path = find_data_file(f"{get_model_dir(active_model)}/archive/processed_results.json")
+archived_results = load_data(archived_path) if os.path.exists(archived_path) else []
+sampler.add_results(archived_results)
+
+success_path = f"{evaluations_dir}/success.json"
+success_jobs = (
+    [EvaluationRecord(result) for result in load_data(success_path)]
+    if os.path.exists(success_path) and os.path.getsize(success_path) > 0
+    else []
+)
+sampler.add_results([record.to_dict() for record in success_jobs])
+failed_jobs = []
+
+client = get_stream_client(model_name=active_model)
+controller = AIMDController(initial_limit=1, max_limit=8)
+
+
+# Function to write the stats of the results so far, with the precision reached
+def save_partial_stats():
+    results = archived_results + [record.to_dict() for record in success_jobs]
+    if not results:
+        return
+
+    stats = structuring_stats_in_metrics(get_descriptive_stats(format_data_to_evaluations(results)))
+    stats["Sampling Precision"] = {
+        "confidence": CONFIDENCE,
+        "target_ci_half_width": TARGET_HALF_WIDTH,
+        "rounds": sampler.rounds,
+        "groups": sampler.precision(),
+    }
+    save_data(stats, f"{results_dir}/stats.json")
+
+
+# Evaluate a single test case of the sample
+def evaluate_test_case(test_case):
+    outcome, duration, record = evaluate_with_ollama(
+        test_case,
+        client,
+        structured=STRUCTURED_OUTPUT,
+        think_budget=THINK_TOKEN_BUDGET,
+    )
+
+    if outcome == OK:
+        success_jobs.append(EvaluationRecord(record))
+    else:
+        failed_jobs.append(FailureRecord(record))
+    return outcome, duration
+
+
+# ===========================================
+# MAIN EXECUTION
+# ===========================================
+while True:
+    round_cases = sampler.next_round()
+    if not round_cases:
+        break
+
+    round_start = len(success_jobs)
+    progress = tqdm(
+        total=len(round_cases),
+        bar_format="[{elapsed}<{remaining}] {n_fmt}/{total_fmt} | {l_bar}{bar} {rate_fmt}{postfix}",
+        desc=f"Round {sampler.rounds}",
+        colour="green",
+    )
+
+    def on_result(test_case, outcome):
+        progress.update(1)
+        return False
+
+    def on_tick(remaining):
+        progress.set_postfix(controller.state())
+
+    run_adaptive(round_cases, evaluate_test_case, controller, on_result, on_tick)
+    progress.close()
+
+    sampler.add_results([record.to_dict() for record in success_jobs[round_start:]])
+    save_data(success_jobs, f"{evaluations_dir}/success.json")
+    save_data(failed_jobs, f"{evaluations_dir}/failed.json")
+    save_partial_stats()
+
+    settled = sum(sampler.is_settled(group) for group in sampler.population)
+    print(f"Round {sampler.rounds}: {settled}/{len(sampler.population)} groups settled (target precision reached or no cases left)")
+
+print("\n------------")
+print("Final Report")
+print("------------")
+print(f"- Evaluated: {len(success_jobs) + len(failed_jobs)} / {len(all_test_cases)}")
+for group, precision in sampler.precision().items():
+    if precision["ci_half_width"] is None:
+        print(f"- {group}: {precision['sampled']}/{precision['population']} sampled | not enough scores")
+        continue
+    print(
+        f"- {group}: {precision['sampled']}/{precision['population']} sampled | "
+        f"mean quality score: {precision['mean_quality_score']:.2f} ± {precision['ci_half_width']:.3f}"
+    )
@@ -0,0 +1,118 @@
+import os
+import threading
+from tqdm import tqdm
+
+from modules.helper import load_data, save_data, filter_unprocessed_test_cases, get_model_dir, find_data_file
+from modules.langchain_helper import get_stream_client
+from modules.prompt_cache import prerender_prompts
+from modules.concurrency import AIMDController, run_adaptive, OK
+from modules.evaluator import evaluate_with_ollama
+from modules.dedup import deduplicate_test_cases, fan_out_result, report_deduplication
+
+# Evaluates every test case with several Ollama models at once. The data is
+# loaded, deduplicated and the prompts are rendered a single time, then each
+# prompt is dispatched to every selected model concurrently; each model writes
+# to its own result store under `data/evaluations/<model>/`.
+#
+# NOTE: Ollama only keeps several models in memory when the GPU has room for
+# them (see OLLAMA_MAX_LOADED_MODELS); `keep_alive` keeps them loaded between
+# requests so they are not swapped in and out during the sweep.
+
+models_list = ["deepseek-r1:1.5b", "llama3.2:3b", "mistral:7b"]
+selected_models = models_list
+
+STRUCTURED_OUTPUT = False
+THINK_TOKEN_BUDGET = 512
+KEEP_ALIVE = "30m"
+
+# Load test cases data and evaluate each unique prompt payload only once
+all_test_cases = load_data("data/cleaned_data.json")
+unique_test_cases, duplicate_cases = deduplicate_test_cases(all_test_cases)
+report_deduplication(all_test_cases, unique_test_cases)
+
+# Render each prompt once (cached on disk), it is shared by all models
+prompts = {
+    key: rendered["prompt"]
+    for key, rendered in prerender_prompts(unique_test_cases, structured=STRUCTURED_OUTPUT).items()
+}
+print(f"Rendered Prompts: {len(prompts)}")
+
+
+# Function to evaluate the remaining test cases of a single model
+def sweep_model(model_name, position):
+    model_dir = get_model_dir(model_name)
+    os.makedirs(model_dir, exist_ok=True)
+
+    # Resume from the model's archive of already processed results
+    processed_path = find_data_file(f"{model_dir}/archive/processed_results.json")
+    processed_test_cases = load_data(processed_path) if os.path.exists(processed_path) else []
+    test_cases = filter_unprocessed_test_cases(unique_test_cases, processed_test_cases)
+
+    client = get_stream_client(model_name=model_name, keep_alive=KEEP_ALIVE)
+    controller = AIMDController(initial_limit=1, max_limit=4)
+    success_jobs = []
+    failed_jobs = []
+
+    progress = tqdm(
+        total=len(test_cases),
+        bar_format="[{elapsed}<{remaining}] {n_fmt}/{total_fmt} | {l_bar}{bar} {rate_fmt}{postfix}",
+        desc=model_name,
+        position=position,
+    )
+
+    def evaluate(test_case):
+        key = (test_case["test_case_id"], test_case["group"])
+        outcome, duration, record = evaluate_with_ollama(
+            test_case,
+            client,
+            structured=STRUCTURED_OUTPUT,
+            think_budget=THINK_TOKEN_BUDGET,
+            reasoning_file=f"{model_dir}/reasoning.jsonl.gz",
+            prompt_text=prompts[key],
+        )
+
+        if outcome == OK:
+            success_jobs.append(record)
+            success_jobs.extend(fan_out_result(record, duplicate_cases[key]))
+        else:
+            failed_jobs.append(record)
+        return outcome, duration
+
+    def on_result(test_case, outcome):
+        progress.update(1)
+
+        # Save results after processing every 10 test case
+        if progress.n % 10 == 0:
+            save_data(success_jobs, f"{model_dir}/success.json")
+            save_data(failed_jobs, f"{model_dir}/failed.json")
+        return False
+
+    def on_tick(remaining):
+        progress.set_postfix(controller.state())
+
+    run_adaptive(test_cases, evaluate, controller, on_result, on_tick)
+    progress.close()
+
+    save_data(success_jobs, f"{model_dir}/success.json")
+    save_data(failed_jobs, f"{model_dir}/failed.json")
+    reports[model_name] = (len(success_jobs), len(failed_jobs))
+
+
+# ===========================================
+# MAIN EXECUTION
+# ===========================================
+reports = {}
+threads = [
+    threading.Thread(target=sweep_model, args=(model_name, position))
+    for position, model_name in enumerate(selected_models)
+]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+print("\n------------")
+print("Final Report")
+print("------------")
+for model_name, (success_count, failed_count) in reports.items():
+    print(f"- {model_name}: Success: {success_count}, Failed: {failed_count}")